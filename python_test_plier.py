@@ -1,219 +1,257 @@
 # -*- coding: utf-8 -*-
-from copy import deepcopy
-import os
-import re
+import time
+# the load time of the plugin is measured from here to the end of the module
+_LOAD_START = time.time()
 
-import sublime
-import sublime_plugin
+import os  # noqa: E402
+import subprocess  # noqa: E402
+import threading  # noqa: E402
 
-from . import utils
+import sublime  # noqa: E402
+import sublime_plugin  # noqa: E402
 
-MYPY = False
-if MYPY:
-    from typing import Optional
+from . import utils  # noqa: E402
+from .utils import run_request  # noqa: E402
+from .utils.output import (  # noqa: E402, F401 (commands are registered on import)
+    TestPlierExecCommand, TestPlierOpenLogCommand, TestPlierReplacePanelCommand,
+    ThrottledRun, show_output,
+)
+from .utils.modules import clear_import_roots, PACKAGE_MARKER, PROJECT_MARKERS  # noqa: E402
+from .utils.run_request import ANSI_SYNTAX  # noqa: E402
+
+SETTINGS_FILE = "SublimeTestPlier.sublime-settings"
 
 
 class RunPythonTestsCommand(sublime_plugin.WindowCommand):
     external_runner = None
 
-    def ansi_installed(self):
-        sublimeansi_installed = (
-            'sublimeansi' in self.packages or 'ansiescape' in self.packages
-        )
-        utils._log('SublimeANSI installed: %s' % sublimeansi_installed)
-        return sublimeansi_installed
-
-    def setup_runner(self):
-        self.settings = sublime.load_settings("SublimeTestPlier.sublime-settings")
-        utils._log("Settings: ", vars(self.settings))
-        self.default_cmd = self.settings.get('default_cmd')
-        utils._log("Default CMD: ", self.default_cmd)
-
-        installed_packages = [
-            filename.split('.')[0]
-            for filename
-            in os.listdir(sublime.installed_packages_path())
-        ]
-        local_packages = os.listdir(sublime.packages_path())
-        self.packages = set(
-            package.lower() for package in installed_packages + local_packages
-        )
-        utils._log("Packages: ", self.packages)
-
-        # get current filename
-        self.filename = self.window.active_view().file_name()
-        utils._log("Filename: ", self.filename)
-
-        self.module = self._get_module(self.filename, base=None)
-        utils._log("Module: ", self.module)
-
-    def _get_module(self, filename, base):
-        """ Convert a filename to a "module" relative to the working path """
-        if not filename or not filename.endswith('.py'):
-            utils._log('Cannot get module for non python-source file: ', filename)
-            return ''  # only pytnon modules are supported
-        base = base or os.path.join(
-            self.window.extract_variables().get('project_path', ''),
-            self.window.extract_variables().get('project_base_name', ''))
-        utils._log('Getting module for file %s relative to base %s' % (filename, base))
-        if not filename.startswith(base):
-            utils._log('Cannot determine module path outside of directory')
-            return ''
-        return filename.replace(base, '').replace(os.path.sep, '.')[:-3].strip('.')
-
-    def _get_default_kwargs(self):
-        kwargs = {
-            'cmd': self.default_cmd,
-            # trim the following string in-between interpolated parts
-            'sep_cleanup': '::',
-        }
-        if self.ansi_installed():
-            kwargs['syntax'] = "Packages/ANSIescape/ANSI.tmLanguage"
-        return kwargs
-
-    def _format_placeholder(self, cmd, sep, **kwargs):
-        result = []
-        for part in cmd:
-            try:
-                part = part.format(**kwargs).strip(sep).strip('.')
-                cleaned_part = re.sub('%s+' % sep, sep, part).strip(sep)
-                if cleaned_part:
-                    result.append(cleaned_part)
-            except KeyError:
-                # ignore commands with unparsed parts
-                continue
-        return result
-
-    def get_pattern(self, view, python_exec):
-        utils._log("View: ", view)
-        pattern = view and utils.get_test(view, use_python=python_exec)
-        utils._log('Test pattern: ', pattern)
-        if not pattern:
-            self.class_name = self.func_name = None
-            return
-        self.class_name, self.func_name = pattern
-
-    def find_venv_root(self, filename):
-        # type: (str) -> Optional[str]
-        dirname = os.path.dirname(os.path.abspath(filename))
-        while dirname != '/':
-            if '.venv' in os.listdir(dirname):
-                venv_file = os.path.join(dirname, '.venv')
-                with open(venv_file) as f:
-                    venv = f.read().strip()
-                utils._log("Venv found '%s' checking path" % venv)
-                venv_path = os.path.expanduser('~/.virtualenvs/%s' % venv)
-                if os.path.exists(venv_path):
-                    utils._log("Venv path exists at '%s'" % venv_path)
-                    return venv_path
-                utils._log("Venv path does not exist at '%s'" % venv_path)
-            dirname = os.path.dirname(dirname)
-        return None
-
-    def get_command_kwargs(self, **addl_kwargs):
-        # prepare default command arguments
-        kwargs = deepcopy(self._get_default_kwargs())
-        extra_args = kwargs.pop('extra_cmd_args', [])
-        kwargs.update(addl_kwargs)
-        kwargs['cmd'].extend(extra_args)
-
-        # get the command environment
-        # TODO: infer from settings.python_interpreter and settings.src_root settings
-        #       as used in https://github.com/JulianEberius/SublimePythonIDE
-        if 'env' not in kwargs:
-            kwargs['env'] = {}
-        if 'PATH' not in kwargs['env']:
-            # add .venv path if it exists
-            venv_path = self.find_venv_root(self.filename)
-            if venv_path:
-                venv_bin_path = '%s/bin' % venv_path
-                kwargs['env']['PATH'] = venv_bin_path
-        # merge path with Sublime's env PATH
-        kwargs['env']['PATH'] = '%s:%s' % (kwargs['env'].get('PATH', ''), os.environ["PATH"])
-        utils._log("Current PATH is %s" % os.getenv("PATH"))
-
-        if 'working_dir' in kwargs:
-            self.module = self._get_module(self.filename, base=kwargs['working_dir'])
-            utils._log("Module updated: ", self.module)
+    def get_settings(self):
+        settings = run_request.snapshot_settings(sublime.load_settings(SETTINGS_FILE))
+        utils._log("Settings: ", settings)
+        return settings
+
+    def prepare(self, view, settings, **command_kwargs):
+        # type: (sublime.View, dict, **object) -> run_request.RunRequest
+        """
+        Return the run request for the current state of given view, building
+        it unless it is cached. Doesn't change any state of the command, so
+        requests may be prepared concurrently (e.g from worker threads).
+        """
+        window_state = run_request.snapshot_window(self.window, utils.get_installed_packages())
+        key = run_request.request_key(view, window_state, command_kwargs, type(self).__name__)
+        request = key and run_request.requests.get(key)
+        if request:
+            utils._log('Using cached request: ', request)
+            return request
+
+        # use a given python executable to parse the tests (using ast)
+        python_executable = command_kwargs.get('python_executable') or settings['python_executable']
+        view_state = run_request.snapshot_view(view, python_executable)
+        request = run_request.build_run_request(
+            view_state, window_state, settings, command_kwargs, external_runner=self.external_runner)
+        if key:
+            run_request.requests.put(key, request)
+        if request.collection_cache:
+            run_request.refresh_collection(request, window_state)
+        return request
+
+    def get_external_command(self, request, settings):
+        utils._log('Running external command (%s)' % (request.external, ))
+
+        if request.external is True:
+            # if "external": true, use our default
+            base_command = utils.get_default_command()
+        elif isinstance(request.external, (list, tuple)):
+            base_command = request.external
         else:
-            kwargs['working_dir'] = ''
+            raise Exception("External command must be either true/false,"
+                            " \"tmux\" or a list of arguments")
 
-        # find the test module/file/pattern in the view
-        view = self.window.active_view()
+        return list(base_command) + [request.shell_command()]
 
-        # use a given python executable to parse the tests (using ast)
-        default_python = self.settings.get('python_executable', None)
-        python_executable = kwargs.pop('python_executable', None) or default_python
-        self.get_pattern(view, python_exec=python_executable)
-
-        fmt_args = dict(
-            module=self.module or '',
-            filename=self.filename or '',
-            test_class=self.class_name or '',
-            test_func=self.func_name or '',
+    def run_in_tmux(self, request, settings):
+        from .utils.tmux import TmuxPane, session_name
+
+        project_name = request.project_name or os.path.basename(request.run_dir)
+        pane = TmuxPane(settings['tmux_session'] or session_name(project_name))
+        # the pane's shell environment (e.g an activated virtualenv) is kept
+        shell_cmd = request.shell_command(inherit_path=True)
+        if_busy = settings['tmux_if_busy']
+
+        def send():
+            try:
+                created = pane.ensure(working_dir=request.run_dir or None)
+                if not created and pane.is_busy():
+                    if if_busy == 'abort':
+                        sublime.status_message(
+                            'Test Plier: tmux session %s is busy, not running tests' % pane.session)
+                        return
+                    elif if_busy == 'interrupt':
+                        pane.interrupt()
+                if settings['tmux_clear']:
+                    pane.clear()
+                pane.send(shell_cmd)
+            except (OSError, subprocess.CalledProcessError) as e:
+                utils._log('Failed to run in tmux: ', e, getattr(e, 'output', ''), debug=True)
+                sublime.status_message('Test Plier: failed to run tests in tmux (%s)' % e)
+                return
+            sublime.status_message('Test Plier: running tests in tmux session %s' % pane.session)
+
+        sublime.set_timeout_async(send, 0)
+
+    def get_throttled_kwargs(self, settings):
+        return dict(
+            flush_interval=settings['output_flush_interval'],
+            max_lines=settings['output_max_lines'],
+            collapse_passed=settings['output_collapse_passed'],
         )
-        selection = utils.get_selection_content(view)
-        if selection:
-            fmt_args['selection'] = selection
 
-        kwargs['cmd'] = self._format_placeholder(
-            kwargs['cmd'], kwargs.pop('sep_cleanup'), **fmt_args)
+    def run_with_result_cache(self, request, settings, force=False):
+        """
+        Show the cached result if the test passed before with the same inputs,
+        otherwise run it (with throttled output) and record the result.
+        """
+        from .utils.result_cache import get_result_cache
+
+        cache = get_result_cache()
+        node_id = ' '.join(request.cmd)
+        env = request.env_dict()
+        roots = [request.working_dir, request.project_path, os.path.dirname(request.filename or '')]
+        key = cache.key(node_id, request.filename, roots, env, request.working_dir)
+        utils._log('Result cache key: ', key)
+
+        cached = None if force else cache.get(node_id, key)
+        if cached:
+            utils._log('Showing cached result for: ', node_id)
+            show_output(self.window, '%s\n[Passed (cached result from %s), run with "force" to re-run]' % (
+                cached['output'], time.strftime('%Y-%m-%d %H:%M:%S', time.localtime(cached['time']))))
+            sublime.status_message('Test Plier: showing cached (passing) result')
+            return
 
-        # default external command can be used if not given
-        if kwargs.get('external', self.external_runner):
-            kwargs['external'] = kwargs.get('external', self.external_runner)
+        def on_finish(returncode, output):
+            if returncode < 0:
+                utils._log('Not recording the result of a run ended by signal %s' % -returncode)
+                return
+            cache.record(node_id, key, returncode, output.render())
+
+        ThrottledRun(
+            self.window, list(request.cmd), env=env, working_dir=request.working_dir,
+            on_finish=on_finish, **self.get_throttled_kwargs(settings)
+        ).start()
+
+    def run_stress(self, request, settings):
+        """ Run the request many times in parallel, and report the results """
+        from .utils.stress import StressRun
+
+        StressRun(
+            self.window, list(request.cmd), request.stress, env=request.env_dict(),
+            working_dir=request.working_dir, max_lines=settings['output_max_lines'],
+        ).start()
+
+    def launch(self, request, settings, force=False):
+        # type: (run_request.RunRequest, dict, bool) -> None
+        """ Run a prepared request, with the runner it (and the settings) choose """
+        if request.stress:
+            utils._log('Running internal command (stress run)')
+            return self.run_stress(request, settings)
+
+        elif request.external == 'tmux':
+            utils._log('Running in tmux with cmd: ', request.cmd)
+            return self.run_in_tmux(request, settings)
+
+        elif request.external:
+            cmd = self.get_external_command(request, settings)
+            utils._log('Running external runner with cmd: %s' % cmd)
+            return self.window.run_command("exec", {'cmd': cmd})
 
-        utils._log("Built command: ", kwargs)
-        return kwargs
+        elif request.result_cache:
+            utils._log('Running internal command (with result cache)')
+            return self.run_with_result_cache(request, settings, force=force)
 
-    def get_external_command(self, external, kwargs):
-        utils._log('Running external command (%s)' % external)
+        kwargs = request.exec_kwargs()
+        if request.throttled_output:
+            utils._log('Running internal command (with throttled output)')
+            if kwargs.get('syntax') == ANSI_SYNTAX:
+                # ANSI escape codes are stripped from the throttled output
+                del kwargs['syntax']
+            kwargs.update(self.get_throttled_kwargs(settings))
+            return self.window.run_command("test_plier_exec", kwargs)
+
+        elif request.ansi:
+            utils._log('Running internal command (with ANSI colors)')
+            return self.window.run_command("ansi_color_build", kwargs)
 
-        if isinstance(external, bool):
-            # if "external": true, use our default
-            default = utils.get_default_command()
-            base_command = self.settings.get("default_external", default)
-        elif isinstance(external, (list, tuple)):
-            base_command = external
         else:
-            raise Exception("External command must be either true/false"
-                            " or a list of arguments")
-
-        _env = ' '.join('%s=%s' % (ename, evalue) for
-                        ename, evalue in kwargs['env'].items())
-        change_dir_cmd = ''
-        if kwargs['working_dir']:
-            change_dir_cmd = 'cd {path} && '.format(path=kwargs['working_dir'])
-        elif self.filename:
-            # for running individual arbitrary test modules
-            filename_dir = os.path.dirname(self.filename)
-            change_dir_cmd = 'cd {path} && '.format(path=filename_dir)
-
-        _cmd = '{cwd}{env_setup} {cmd}'.format(
-            cwd=change_dir_cmd,
-            cmd=' '.join(kwargs['cmd']),
-            env_setup=_env,
-        )
-        return (base_command) + [_cmd]
+            utils._log('Running internal command (without ANSI colors)')
+            return self.window.run_command("exec", kwargs)
 
     def run(self, *args, **command_kwargs):
         utils._log('SublimeTestPlier running in debug mode')
         utils._log("Args: %s" % list(args))
         utils._log("Kwargs: %s" % command_kwargs)
 
-        self.setup_runner()
+        force = command_kwargs.pop('force', False)
+        settings = self.get_settings()
+        with utils.timed('Preparing the request'):
+            try:
+                request = self.prepare(self.window.active_view(), settings, **command_kwargs)
+            except run_request.NothingToRun as e:
+                sublime.status_message('Test Plier: %s' % e)
+                return
+        self.launch(request, settings, force=force)
 
-        kwargs = self.get_command_kwargs(**command_kwargs)
 
-        if 'external' in kwargs:
-            cmd = self.get_external_command(kwargs['external'], kwargs)
-            utils._log('Running external runner with cmd: %s' % kwargs)
-            return self.window.run_command("exec", {'cmd': cmd})
+class TestPlierForgetFlakyTestsCommand(sublime_plugin.WindowCommand):
+    """ Allow caching results of tests which were found to be flaky again """
 
-        elif self.ansi_installed():
-            utils._log('Running internal command (with ANSI colors)')
-            return self.window.run_command("ansi_color_build", kwargs)
+    def run(self):
+        from .utils.result_cache import get_result_cache
 
-        else:
-            utils._log('Running internal command (without ANSI colors)')
-            return self.window.run_command("exec", kwargs)
+        count = get_result_cache().clear_flaky()
+        sublime.status_message('Test Plier: forgot %s flaky tests' % count)
+
+
+class TestPlierEventListener(sublime_plugin.EventListener):
+    def on_post_save_async(self, view):
+        from .utils.fixtures import is_test_file
+
+        # adding a package or project file may change where modules import from
+        filename = os.path.basename(view.file_name() or '')
+        if filename in (PACKAGE_MARKER, ) + PROJECT_MARKERS:
+            clear_import_roots()
+            run_request.bump_revision()
+        elif is_test_file(filename):
+            # tests (or fixtures) may have been added, prepared requests are stale
+            run_request.bump_revision()
+
+
+def warm_up():
+    """
+    One-time work done in the background after loading, so neither startup
+    nor the first test run have to wait for it.
+    """
+    with utils.timed('Warm-up'):
+        settings = sublime.load_settings(SETTINGS_FILE)
+        utils.get_installed_packages(refresh=True)
+        if sublime.platform() == 'osx':
+            utils.provision_external_scripts()
+        # import the modules of optional features
+        from .utils import tmux  # noqa: F401
+        from .utils.result_cache import get_result_cache
+        if settings.get('result_cache', False):
+            get_result_cache()
+
+
+def plugin_loaded():
+    # warm-up is done (and its time logged) separately, in the background
+    utils._log('SublimeTestPlier loaded in %.1fms' % (_LOAD_TIME * 1000))
+    # cached run requests depend on the settings
+    sublime.load_settings(SETTINGS_FILE).add_on_change('test_plier', run_request.bump_revision)
+    threading.Thread(target=warm_up).start()
+
+
+def plugin_unloaded():
+    sublime.load_settings(SETTINGS_FILE).clear_on_change('test_plier')
+
+
+_LOAD_TIME = time.time() - _LOAD_START
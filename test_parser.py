@@ -5,15 +5,29 @@ See TestParser docstring below for details.
 Usage:
 
     python test_parser.py <source_module> <line>
+    python test_parser.py --json [--jobs <N>] [<source_module>:<line> ...]
 
 Example:
 
     > python test_parser.py your_source_file.py 4
     TestCase,test_method
 
+In batch (--json) mode, queries are given as arguments, or as JSON lines
+(`{"file": "your_source_file.py", "line": 4}`) on stdin, and each query is
+answered with a JSON line, in the same order. Every module is parsed once,
+regardless of the number of queried lines; use --jobs to parse modules in
+a pool of processes.
+
+    > python test_parser.py --json your_source_file.py:4 your_source_file.py:9
+    {"class": "TestCase", "file": "your_source_file.py", "function": "test_method", "line": 4}
+    {"class": null, "file": "your_source_file.py", "function": "test_func", "line": 9}
+
 """
 from __future__ import print_function
+import argparse
 import ast
+import json
+import multiprocessing
 import sys
 
 
@@ -85,6 +99,7 @@ class TestParser(ast.NodeVisitor):
     (None, 'test_first')
     """
     nested_class = None
+    tree = None
 
     def __init__(self, source, debug=False, ignore_bases=None):
         self.source = source
@@ -103,8 +118,9 @@ class TestParser(ast.NodeVisitor):
         self.nearest_func = None
         self.nearest_ignored = None
         self.lineno = line
-        tree = ast.parse(self.source)
-        self.visit(tree)
+        if self.tree is None:
+            self.tree = ast.parse(self.source)
+        self.visit(self.tree)
         return (
             getattr(self.nearest_class, 'name', None),
             getattr(self.nearest_func, 'name', None),
@@ -204,7 +220,158 @@ class TestParser(ast.NodeVisitor):
         return self.generic_visit(node)
 
 
+def resolve_file(query):
+    """
+    Resolve all (line numbers) of a (filename, lines) query, parsing the
+    module once. Returns a result dict for each line.
+    """
+    filename, lines = query
+    try:
+        with open(filename) as module_file:
+            parser = TestParser(module_file.read())
+        results = [parser.parse(line=line) for line in lines]
+    except (IOError, SyntaxError, TypeError, ValueError) as e:
+        return [dict(file=filename, line=line, error=str(e)) for line in lines]
+    return [
+        {'file': filename, 'line': line, 'class': class_name, 'function': func_name}
+        for line, (class_name, func_name) in zip(lines, results)
+    ]
+
+
+def resolve_batch(queries, jobs=1):
+    """
+    Resolve many (filename, line) queries, returning a result dict for each
+    query (in the same order). When `jobs` > 1, files are parsed in a pool of
+    processes.
+
+    >>> from os import path
+    >>> fixture = path.join(path.abspath(path.dirname(__file__)), 'tests', '_fixture.py')
+    >>> results = resolve_batch([(fixture, 5), ('missing.py', 1), (fixture, 14)])
+    >>> [(result['class'], result['function']) for result in results[::2]]
+    [('AnotherClass', 'test_method'), ('SomeTest', 'test_addition')]
+
+    >>> results[1]['error']
+    "[Errno 2] No such file or directory: 'missing.py'"
+    """
+    files = []
+    lines_by_file = {}
+    for filename, line in queries:
+        if filename not in lines_by_file:
+            files.append(filename)
+            lines_by_file[filename] = []
+        lines_by_file[filename].append(int(line))
+    file_queries = [(filename, lines_by_file[filename]) for filename in files]
+
+    if jobs > 1 and len(file_queries) > 1:
+        pool = multiprocessing.Pool(min(jobs, len(file_queries)))
+        try:
+            file_results = pool.map(resolve_file, file_queries)
+        finally:
+            pool.close()
+    else:
+        file_results = [resolve_file(file_query) for file_query in file_queries]
+
+    results_by_file = dict(zip(files, [iter(results) for results in file_results]))
+    return [next(results_by_file[filename]) for filename, line in queries]
+
+
+def parse_query(query):
+    r"""
+    >>> parse_query('C:\\tests\\test_module.py:12')
+    ('C:\\tests\\test_module.py', 12)
+    >>> parse_query('test_module.py')
+    Traceback (most recent call last):
+    ...
+    ValueError: expected <source_module>:<line>, got 'test_module.py'
+    >>> parse_query('test_module.py:0')
+    Traceback (most recent call last):
+    ...
+    ValueError: expected <source_module>:<line>, got 'test_module.py:0'
+    """
+    filename, _, line = query.rpartition(':')
+    if not filename or not line.isdigit() or int(line) < 1:
+        raise ValueError('expected <source_module>:<line>, got %r' % query)
+    return filename, int(line)
+
+
+def parse_json_query(line):
+    """
+    >>> parse_json_query('{"file": "test_module.py", "line": 12}')
+    ('test_module.py', 12)
+    >>> parse_json_query('{"file": 1, "line": 12}')
+    Traceback (most recent call last):
+    ...
+    ValueError: invalid file: 1
+    >>> parse_json_query('{"file": "test_module.py", "line": 0}')
+    Traceback (most recent call last):
+    ...
+    ValueError: invalid line: 0
+    """
+    query = json.loads(line)
+    if not isinstance(query, dict) or 'file' not in query or 'line' not in query:
+        raise ValueError('expected {"file": ..., "line": ...}')
+    # anything but a path (e.g a number, taken as a file descriptor) isn't opened
+    if not isinstance(query['file'], str) or not query['file']:
+        raise ValueError('invalid file: %r' % (query['file'],))
+    try:
+        line_number = int(query['line'])
+    except (TypeError, ValueError):
+        line_number = 0
+    if line_number < 1:
+        raise ValueError('invalid line: %r' % (query['line'],))
+    return query['file'], line_number
+
+
+def resolve_json_lines(lines, jobs=1):
+    """
+    Resolve JSON line queries, like `resolve_batch()`; a result dict with an
+    error is returned for each invalid query, rather than failing them all.
+
+    >>> results = resolve_json_lines(['{"file": "missing.py", "line": 1}', '{"file": "missing.py"}'])
+    >>> [sorted(result) for result in results]
+    [['error', 'file', 'line'], ['error', 'query']]
+    >>> results[1]['error']
+    'expected {"file": ..., "line": ...}'
+    """
+    queries, errors = [], {}
+    for index, line in enumerate(line for line in lines if line.strip()):
+        try:
+            queries.append(parse_json_query(line))
+        except ValueError as e:
+            errors[index] = dict(query=line.strip(), error=str(e))
+    results = iter(resolve_batch(queries, jobs=jobs))
+    return [
+        errors[index] if index in errors else next(results)
+        for index in range(len(queries) + len(errors))
+    ]
+
+
+def batch_cli(argv):
+    arg_parser = argparse.ArgumentParser(description='Resolve test names in batch (JSON) mode')
+    arg_parser.add_argument('--json', action='store_true', required=True)
+    arg_parser.add_argument('--jobs', type=int, default=1,
+                            help='number of processes to parse modules with')
+    arg_parser.add_argument('queries', nargs='*', metavar='<source_module>:<line>',
+                            help='queries to resolve (default: read JSON lines from stdin)')
+    args = arg_parser.parse_args(argv)
+
+    if args.queries:
+        try:
+            queries = [parse_query(query) for query in args.queries]
+        except ValueError as e:
+            arg_parser.error(str(e))
+        results = resolve_batch(queries, jobs=args.jobs)
+    else:
+        results = resolve_json_lines(sys.stdin, jobs=args.jobs)
+
+    for result in results:
+        print(json.dumps(result, sort_keys=True))
+
+
 def cli():
+    if '--json' in sys.argv[1:]:
+        return batch_cli(sys.argv[1:])
+
     if not len(sys.argv) == 3:
         sys.exit('Missing required arguments!\n%s' % __doc__)
 
@@ -58,10 +58,16 @@ def settings_loader(settings_file):
 
 
 command_runner = mock.Mock(side_effect=run_command)
-view = mock.Mock(run_command=command_runner, _buffer=_buffer)
+view = mock.Mock(
+    run_command=command_runner, _buffer=_buffer,
+    indexed_symbol_regions=mock.Mock(return_value=[]),
+    symbol_regions=mock.Mock(return_value=[]),
+    find_by_selector=mock.Mock(return_value=[]),
+)
 window = mock.Mock(
     active_view=mock.Mock(return_value=view),
     extract_variables=mock.Mock(return_value={}),
+    folders=mock.Mock(return_value=[]),
     new_file=mock.Mock(return_value=view),
     run_command=command_runner,
 )
@@ -77,7 +83,10 @@ WindowCommand = type(
     object.__name__, (mock.MagicMock,),
     dict(object.__dict__, window=window)
 )
-sublime_plugin = mock.MagicMock(WindowCommand=WindowCommand)
+TextCommand = type(object.__name__, (mock.MagicMock,), dict(object.__dict__, view=view))
+EventListener = type(object.__name__, (mock.MagicMock,), dict(object.__dict__))
+sublime_plugin = mock.MagicMock(
+    WindowCommand=WindowCommand, TextCommand=TextCommand, EventListener=EventListener)
 
 sys.modules['sublime'] = sublime
 sys.modules['sublime_plugin'] = sublime_plugin
@@ -0,0 +1,136 @@
+import os
+import shutil
+import sys
+import tempfile
+from unittest import TestCase, mock
+
+from . import sublime_mock  # noqa: F401
+from ..utils import collection
+
+TEST_MODULE = """import pytest
+
+
+class TestA:
+    def test_one(self):
+        pass
+
+    @pytest.mark.parametrize('x', [1, 2])
+    def test_two(self, x):
+        pass
+
+
+def test_three():
+    pass
+"""
+COLLECT_OUTPUT = """test_m.py::TestA::test_one
+test_m.py::TestA::test_two[1]
+
+==================================== ERRORS ====================================
+_________________________ ERROR collecting test_bad.py _________________________
+test_bad.py::oops
+1 test collected, 1 error in 0.04s
+"""
+
+
+class TestParsing(TestCase):
+    def test_pytest_command(self):
+        assert collection.pytest_command(['pytest', '-v']) == ['pytest']
+        assert collection.pytest_command(['/venv/bin/py.test']) == ['/venv/bin/py.test']
+        assert collection.pytest_command(['python3', '-m', 'pytest', '-v']) == ['python3', '-m', 'pytest']
+        assert collection.pytest_command(['nosetests']) is None
+
+    def test_parse_collect_output(self):
+        assert collection.parse_collect_output(COLLECT_OUTPUT) == [
+            'test_m.py::TestA::test_one', 'test_m.py::TestA::test_two[1]']
+
+    def test_parse_collected_count(self):
+        assert collection.parse_collected_count(COLLECT_OUTPUT) == 1
+        assert collection.parse_collected_count('3/4 tests collected (1 deselected) in 0.01s') == 3
+        assert collection.parse_collected_count('collected 4 items\n') == 4
+        assert collection.parse_collected_count('no tests ran in 0.01s') is None
+
+    def test_simple_selection(self):
+        assert collection.is_simple_selection('test_two')
+        assert collection.is_simple_selection('test_two[1]')
+        assert not collection.is_simple_selection('one or two')
+        assert not collection.is_simple_selection('not')
+
+
+class TestCollectionCache(TestCase):
+    def setUp(self):
+        self.root = os.path.realpath(tempfile.mkdtemp())
+        self.addCleanup(shutil.rmtree, self.root)
+        self.module = self.write('test_m.py', TEST_MODULE)
+        self.cache_path = os.path.join(self.root, '.cache.json')
+
+    def write(self, filename, content):
+        path = os.path.join(self.root, filename)
+        with open(path, 'w') as f:
+            f.write(content)
+        return path
+
+    def refresh(self, cache):
+        return cache.refresh([sys.executable, '-m', 'pytest'])
+
+    def test_refresh(self):
+        self.write('test_bad.py', 'import nope\n')
+        cache = collection.CollectionCache(self.root, self.cache_path)
+        assert cache.node_ids(self.module) is None
+        assert self.refresh(cache) is True
+        assert cache.node_ids(self.module) == [
+            'TestA::test_one', 'TestA::test_two[1]', 'TestA::test_two[2]', 'test_three']
+        # modules which failed to collect are collected again
+        assert cache.node_ids(os.path.join(self.root, 'test_bad.py')) is None
+
+        # stored on disk
+        cache = collection.CollectionCache(self.root, self.cache_path)
+        assert len(cache.node_ids(self.module)) == 4
+
+    def test_verbose_addopts(self):
+        self.write('pytest.ini', '[pytest]\naddopts = -v\n')
+        cache = collection.CollectionCache(self.root)
+        assert self.refresh(cache) is True
+        assert len(cache.node_ids(self.module)) == 4
+
+    def test_unexpected_output(self):
+        output = b'<Module test_m.py>\n  <Function test_three>\n\ncollected 1 item\n'
+        with mock.patch.object(collection.subprocess, 'Popen') as popen:
+            popen.return_value.communicate.return_value = (output, None)
+            popen.return_value.returncode = 0
+            assert collection.collect(['pytest'], [self.module], self.root) == (None, None)
+        # nothing is stored, so modules are collected again next time
+        cache = collection.CollectionCache(self.root)
+        with mock.patch.object(collection, 'collect', return_value=(None, None)):
+            assert self.refresh(cache) is False
+        assert cache.node_ids(self.module) is None
+
+    def test_only_changed_modules_are_collected(self):
+        other = self.write('test_other.py', 'def test_other():\n    pass\n')
+        cache = collection.CollectionCache(self.root)
+        self.refresh(cache)
+        assert self.refresh(cache) is False
+
+        os.utime(other, (0, 0))
+        with mock.patch.object(collection, 'collect', return_value=([], 5)) as collect:
+            assert self.refresh(cache) is True
+        assert collect.call_args[0][1] == [other]
+        assert cache.node_ids(other) == []
+
+        # a changed conftest.py affects all modules below it
+        self.write('conftest.py', '')
+        with mock.patch.object(collection, 'collect', return_value=([], 5)) as collect:
+            self.refresh(cache)
+        assert collect.call_args[0][1] == [self.module, other]
+
+    def test_resolve(self):
+        cache = collection.CollectionCache(self.root)
+        assert cache.resolve(self.module, 'two') is None  # not collected yet
+        self.refresh(cache)
+        assert cache.resolve(self.module, 'two') == ['TestA::test_two[1]', 'TestA::test_two[2]']
+        assert cache.resolve(self.module, 'TESTA') == [
+            'TestA::test_one', 'TestA::test_two[1]', 'TestA::test_two[2]']
+        assert cache.resolve(self.module, 'test_', test_class='TestA', test_func='test_two') == [
+            'TestA::test_two[1]', 'TestA::test_two[2]']
+        assert cache.resolve(self.module, 'missing') == []
+        # expressions are left to pytest
+        assert cache.resolve(self.module, 'one or two') is None
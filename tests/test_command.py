@@ -1,16 +1,20 @@
 from unittest import TestCase, mock
+import os
 import sys
 
 from .sublime_mock import sublime, known_commands
 from ..python_test_plier import RunPythonTestsCommand
 from .. import utils
+from ..utils import collection, fixtures, run_request, stress, tmux
 
 exec_cmd = mock.Mock()
 ansi_cmd = mock.Mock()
+throttled_cmd = mock.Mock()
 
 known_commands['run_python_tests'] = RunPythonTestsCommand
 known_commands['ansi_color_build'] = ansi_cmd
 known_commands['exec'] = exec_cmd
+known_commands['test_plier_exec'] = throttled_cmd
 
 TEST_CONTENT = """import unittest
 class TestCase(unittest.TestCase):
@@ -40,6 +44,8 @@ class TestPlierCommand(TestCase):
             cmd=["nosetests", "-k {filename}:{test_class}.{test_func}"],
             sep_cleanup=':'
         )
+        utils._installed_packages = None
+        run_request.requests.clear()
         self.debug_patcher = mock.patch.object(utils, 'DEBUG', return_value=True)
         self.debug_patcher.start()
         self.addCleanup(self.debug_patcher.stop)
@@ -47,6 +53,7 @@ class TestPlierCommand(TestCase):
     def tearDown(self):
         exec_cmd.reset_mock()
         ansi_cmd.reset_mock()
+        throttled_cmd.reset_mock()
 
     def setText(self, string):
         self.view.run_command("insert", {"characters": string})
@@ -69,6 +76,27 @@ class TestPlierCommand(TestCase):
             syntax='Packages/ANSIescape/ANSI.tmLanguage',
             cmd=['pytest', ] + DEFAULT_CMD_ARGS + ['file.py', ]))
 
+    @mock.patch('os.listdir', return_value=['SublimeANSI'])
+    def test_command_with_throttled_output(self, listdir):
+        self.view.run_command("run_python_tests", throttled_output=True)
+        assert exec_cmd.called is False
+        assert ansi_cmd.called is False
+        throttled_cmd.assert_called_once_with(dict(
+            working_dir='', env=mock.ANY,
+            flush_interval=200, max_lines=1000, collapse_passed=True,
+            cmd=['pytest', ] + DEFAULT_CMD_ARGS + ['file.py', ]))
+
+    def test_command_after_installing_ansi(self):
+        with mock.patch('os.listdir', return_value=[]):
+            self.view.run_command("run_python_tests")
+        assert ansi_cmd.called is False
+        # installing a package changes the mtime of the packages directory
+        self.view.substr.side_effect = [TEST_CONTENT, '']
+        with mock.patch('os.listdir', return_value=['SublimeANSI']), \
+                mock.patch.object(utils, '_packages_mtimes', return_value=(1.0, 1.0)):
+            self.view.run_command("run_python_tests")
+        assert ansi_cmd.called is True
+
     def test_command_executed_with_filename(self):
         self.view.run_command("run_python_tests")
         exec_cmd.assert_called_once_with(dict(
@@ -89,6 +117,55 @@ class TestPlierCommand(TestCase):
             working_dir='', env={},
             cmd=['pytest', '-k test 1', ] + DEFAULT_CMD_ARGS + ['file.py', ]))
 
+    @mock.patch.object(collection, 'refresh_async')
+    def test_command_selection_resolved_from_collection(self, refresh_async):
+        self.view.substr.return_value = self.mock_selection(0, 0, 'fail')
+        cache = mock.Mock(resolve=mock.Mock(return_value=['TestCase::test_fail']))
+        with mock.patch.object(collection, 'get_collection', return_value=cache):
+            self.view.run_command("run_python_tests", collection_cache=True, env={'PATH': '/bin'})
+        cache.resolve.assert_called_once_with(os.path.abspath('file.py'), 'fail', None, None)
+        exec_cmd.assert_called_once_with(dict(
+            working_dir='', env=mock.ANY,
+            cmd=['pytest', ] + DEFAULT_CMD_ARGS + ['%s::TestCase::test_fail' % os.path.abspath('file.py')]))
+        assert refresh_async.call_args[0][1] == ['pytest']
+
+    @mock.patch.object(collection, 'refresh_async')
+    def test_command_selection_not_collected(self, refresh_async):
+        self.view.substr.return_value = self.mock_selection(0, 0, 'fail')
+        cache = mock.Mock(resolve=mock.Mock(return_value=None))
+        with mock.patch.object(collection, 'get_collection', return_value=cache):
+            self.view.run_command("run_python_tests", collection_cache=True, env={'PATH': '/bin'})
+        exec_cmd.assert_called_once_with(dict(
+            working_dir='', env=mock.ANY,
+            cmd=['pytest', '-k fail'] + DEFAULT_CMD_ARGS + ['file.py']))
+
+    @mock.patch.object(stress, 'StressRun')
+    def test_command_stress_run(self, stress_run):
+        self.view.substr.return_value = self.mock_selection(1, 0)
+        self.view.run_command(
+            "run_python_tests", stress=20, stress_fail_fast=True, stress_seed=7, env={'PATH': '/bin'})
+        assert exec_cmd.called is False
+        stress_run.assert_called_once_with(
+            self.window, ['pytest', ] + DEFAULT_CMD_ARGS + ['file.py::TestCase'],
+            stress.StressOptions(runs=20, fail_fast=True, seed=7),
+            env=mock.ANY, working_dir='', max_lines=1000)
+        stress_run.return_value.start.assert_called_once_with()
+
+    def test_command_reuses_prepared_request(self):
+        self.view.substr.return_value = self.mock_selection(1, 0)
+        self.view.run_command("run_python_tests", env={'PATH': '/bin'})
+        # the view isn't read again while it (and the settings) don't change
+        self.view.substr.side_effect = AssertionError('view was read')
+        self.view.run_command("run_python_tests", env={'PATH': '/bin'})
+        assert exec_cmd.call_count == 2
+        assert exec_cmd.call_args_list[0] == exec_cmd.call_args_list[1]
+        assert exec_cmd.call_args[0][0]['cmd'][-1] == 'file.py::TestCase'
+
+        run_request.bump_revision()
+        self.view.substr.side_effect = [TEST_CONTENT, '']
+        self.view.run_command("run_python_tests", env={'PATH': '/bin'})
+        assert exec_cmd.call_count == 3
+
     def test_command_executed_with_cursor_on_class(self):
         self.view.substr.return_value = self.mock_selection(1, 0)
         self.view.run_command("run_python_tests")
@@ -154,6 +231,8 @@ class TestPlierCommand(TestCase):
 
             self.view.file_name.return_value = fp.name
             self.view.substr.return_value = self.mock_selection(1, 0)
+            # the source is parsed from the file, not copied from the view
+            self.view.substr.side_effect = ['']
             python = sys.executable
             self.view.run_command("run_python_tests", python_executable=python)
 
@@ -161,3 +240,57 @@ class TestPlierCommand(TestCase):
             working_dir=mock.ANY, env=mock.ANY,
             cmd=['pytest', ] + DEFAULT_CMD_ARGS + ['%s::TestCase' % fp.name, ]
         ))
+
+    @mock.patch.object(sublime, 'set_timeout_async', side_effect=lambda func, delay: func())
+    @mock.patch.object(tmux.subprocess, 'check_output', return_value=b'bash\n')
+    def test_command_external_tmux(self, check_output, set_timeout_async):
+        self.view.file_name.return_value = '/my project/test file.py'
+        self.window.extract_variables.return_value = {'project_base_name': 'my project'}
+        self.view.run_command("run_python_tests", external='tmux', env={'PATH': '/bin'})
+        assert exec_cmd.called is False
+        tmux_calls = [call[0][0][1:] for call in check_output.call_args_list]
+        assert tmux_calls[:2] == [
+            ['has-session', '-t', 'test-plier-my_project'],
+            ['display-message', '-p', '-t', 'test-plier-my_project:', '#{pane_current_command}'],
+        ]
+        assert tmux_calls[2][:4] == ['send-keys', '-t', 'test-plier-my_project:', '-l']
+        assert tmux_calls[2][4] == (
+            "cd '/my project' && PATH=/bin:\"$PATH\" "
+            "pytest --doctest-modules --doctest-ignore-import-errors -v '/my project/test file.py'")
+        assert tmux_calls[3] == ['send-keys', '-t', 'test-plier-my_project:', 'Enter']
+
+    @mock.patch.object(sublime, 'set_timeout_async', side_effect=lambda func, delay: func())
+    @mock.patch.object(tmux.subprocess, 'check_output', return_value=b'python\n')
+    def test_command_external_tmux_busy(self, check_output, set_timeout_async):
+        self.view.run_command("run_python_tests", external='tmux')
+        tmux_calls = [call[0][0][1] for call in check_output.call_args_list]
+        assert tmux_calls == ['has-session', 'display-message']
+
+    def test_command_runs_tests_using_fixture(self):
+        import shutil
+        import tempfile
+
+        root = os.path.realpath(tempfile.mkdtemp())
+        self.addCleanup(shutil.rmtree, root)
+        conftest_source = "import pytest\n\n@pytest.fixture\ndef db():\n    pass\n"
+        for filename, content in [
+                ('conftest.py', conftest_source),
+                ('test_a.py', "def test_db(db):\n    pass\n\ndef test_other():\n    pass\n"),
+                ('test_b.py', "class TestB:\n    def test_db(self, db):\n        pass\n")]:
+            with open(os.path.join(root, filename), 'w') as f:
+                f.write(content)
+
+        self.view.file_name.return_value = os.path.join(root, 'conftest.py')
+        self.window.folders.return_value = [root]
+        self.mock_selection(4, 0)
+        self.view.substr.side_effect = [conftest_source, '']
+        with mock.patch.object(fixtures, 'get_cache_dir', return_value=root):
+            self.view.run_command("run_python_tests")
+        self.window.folders.return_value = []
+
+        exec_cmd.assert_called_once_with(dict(
+            working_dir='', env=mock.ANY,
+            cmd=['pytest', ] + DEFAULT_CMD_ARGS + [
+                os.path.join(root, 'test_a.py::test_db'),
+                os.path.join(root, 'test_b.py::TestB::test_db'),
+            ]))
@@ -0,0 +1,147 @@
+import ast
+import os
+import shutil
+import tempfile
+from unittest import TestCase, mock
+
+from . import sublime_mock  # noqa: F401
+from ..utils import fixtures
+from ..utils.fixtures import FixtureIndex, parse_fixtures
+
+CONFTEST = """import pytest
+
+@pytest.fixture
+def db():
+    pass
+
+@pytest.fixture(name='user')
+def user_fixture(db):
+    pass
+
+@pytest.fixture(autouse=True)
+def clean_cache():
+    pass
+"""
+
+TEST_MODELS = """import pytest
+
+pytestmark = pytest.mark.usefixtures('settings')
+
+@pytest.fixture
+def settings():
+    pass
+
+def test_user(user):
+    pass
+
+def test_plain():
+    pass
+"""
+
+TEST_VIEWS = """import pytest
+
+@pytest.fixture
+def db(db):
+    pass
+
+@pytest.mark.usefixtures('client')
+class TestViews:
+    @pytest.fixture
+    def client(self, user):
+        pass
+
+    def test_view(self):
+        pass
+
+def test_db(db, default=None):
+    pass
+"""
+
+
+class TestParseFixtures(TestCase):
+    def test_parse(self):
+        parsed = parse_fixtures(TEST_VIEWS)
+        assert sorted(parsed['fixtures']) == ['::db', 'TestViews::client']
+        assert parsed['fixtures']['TestViews::client']['requests'] == ['user']
+        assert parsed['tests'] == [
+            {'class': 'TestViews', 'func': 'test_view', 'requests': ['client']},
+            {'class': None, 'func': 'test_db', 'requests': ['db']},
+        ]
+
+    def test_parse_names_and_marks(self):
+        conftest = parse_fixtures(CONFTEST)['fixtures']
+        assert conftest['::user']['func'] == 'user_fixture'
+        assert conftest['::clean_cache']['autouse'] is True
+        assert parse_fixtures(TEST_MODELS)['tests'][0]['requests'] == ['user', 'settings']
+
+    def test_autouse_as_name(self):
+        # before python 3.4 (e.g Sublime Text 3) True is parsed as a name
+        tree = ast.parse('@pytest.fixture(autouse=True)\ndef clean():\n    pass\n')
+        tree.body[0].decorator_list[0].keywords[0].value = ast.Name(id='True', ctx=ast.Load())
+        with mock.patch.object(fixtures.ast, 'parse', return_value=tree):
+            assert parse_fixtures('')['fixtures']['::clean']['autouse'] is True
+
+
+class TestFixtureIndex(TestCase):
+    def setUp(self):
+        self.root = os.path.realpath(tempfile.mkdtemp())
+        self.addCleanup(shutil.rmtree, self.root)
+        self.conftest = self.write('tests/conftest.py', CONFTEST)
+        self.test_models = self.write('tests/test_models.py', TEST_MODELS)
+        self.test_views = self.write('tests/views/test_views.py', TEST_VIEWS)
+        self.write('other/test_other.py', 'def test_other(db):\n    pass\n')
+        self.cache_path = os.path.join(self.root, 'index.json')
+        self.index = FixtureIndex(self.root, cache_path=self.cache_path)
+        self.index.update()
+
+    def write(self, path, content):
+        path = os.path.join(self.root, *path.split('/'))
+        if not os.path.exists(os.path.dirname(path)):
+            os.makedirs(os.path.dirname(path))
+        with open(path, 'w') as f:
+            f.write(content)
+        return path
+
+    def users_of(self, path, class_name, func_name):
+        fixture_id = self.index.find_fixture(path, class_name, func_name)
+        return [
+            (os.path.relpath(test_path, self.root), class_name, func_name)
+            for test_path, class_name, func_name in self.index.tests_using(fixture_id)
+        ]
+
+    def test_tests_using_conftest_fixture(self):
+        # directly, through the user fixture, and through an overriding fixture
+        assert self.users_of(self.conftest, None, 'db') == [
+            (os.path.join('tests', 'test_models.py'), None, 'test_user'),
+            (os.path.join('tests', 'views', 'test_views.py'), 'TestViews', 'test_view'),
+            (os.path.join('tests', 'views', 'test_views.py'), None, 'test_db'),
+        ]
+
+    def test_tests_using_overriding_and_class_fixtures(self):
+        assert self.users_of(self.test_views, None, 'db') == [
+            (os.path.join('tests', 'views', 'test_views.py'), 'TestViews', 'test_view'),
+            (os.path.join('tests', 'views', 'test_views.py'), None, 'test_db'),
+        ]
+        assert self.users_of(self.test_views, 'TestViews', 'client') == [
+            (os.path.join('tests', 'views', 'test_views.py'), 'TestViews', 'test_view'),
+        ]
+
+    def test_tests_using_module_and_autouse_fixtures(self):
+        assert self.users_of(self.test_models, None, 'settings') == [
+            (os.path.join('tests', 'test_models.py'), None, 'test_user'),
+            (os.path.join('tests', 'test_models.py'), None, 'test_plain'),
+        ]
+        assert len(self.users_of(self.conftest, None, 'clean_cache')) == 4
+
+    def test_index_is_cached_and_updated_by_mtime(self):
+        index = FixtureIndex(self.root, cache_path=self.cache_path)
+        assert sorted(index.files) == sorted(self.index.files)
+
+        self.write('tests/test_models.py', 'def test_new(user):\n    pass\n')
+        os.utime(self.test_models, (0, 0))
+        index.update()
+        assert index.files[self.test_models]['tests'][0]['func'] == 'test_new'
+
+        os.remove(self.test_models)
+        index.update()
+        assert self.test_models not in index.files
@@ -0,0 +1,79 @@
+import os
+import shutil
+import tempfile
+from unittest import TestCase
+
+from . import sublime_mock  # noqa: F401
+from ..utils import modules
+
+
+class TestGetModule(TestCase):
+    def setUp(self):
+        self.root = os.path.realpath(tempfile.mkdtemp())
+        self.addCleanup(shutil.rmtree, self.root)
+        self.addCleanup(modules.clear_import_roots)
+
+    def touch(self, *parts):
+        path = os.path.join(self.root, *parts)
+        if not os.path.exists(os.path.dirname(path)):
+            os.makedirs(os.path.dirname(path))
+        open(path, 'w').close()
+        return path
+
+    def test_regular_package(self):
+        self.touch('project', 'setup.cfg')
+        self.touch('project', 'app', '__init__.py')
+        self.touch('project', 'app', 'tests', '__init__.py')
+        test_file = self.touch('project', 'app', 'tests', 'test_views.py')
+        assert modules.get_module(test_file) == 'app.tests.test_views'
+        # the base (e.g the project directory) is only a fallback
+        assert modules.get_module(test_file, base=os.path.dirname(test_file)) == 'app.tests.test_views'
+
+    def test_working_dir(self):
+        # as in the Django example: the tests are run from a sub-directory of the project
+        self.touch('setup.cfg')
+        test_file = self.touch('project', 'tests', 'test_views.py')
+        working_dir = os.path.join(self.root, 'project')
+        assert modules.get_module(test_file) == 'project.tests.test_views'
+        assert modules.get_module(test_file, working_dir=working_dir) == 'tests.test_views'
+        # unless the import root is inside the working dir
+        self.touch('project', 'tests', '__init__.py')
+        modules.clear_import_roots()
+        assert modules.get_module(test_file, working_dir=self.root) == 'tests.test_views'
+        self.touch('project', 'src', 'app', '__init__.py')
+        models = self.touch('project', 'src', 'app', 'models.py')
+        assert modules.get_module(models, working_dir=self.root) == 'app.models'
+        # or the file is outside of it
+        assert modules.get_module(models, working_dir=os.path.join(self.root, 'other')) == 'app.models'
+
+    def test_src_layout(self):
+        self.touch('project', 'pyproject.toml')
+        self.touch('project', 'src', 'app', '__init__.py')
+        assert modules.get_module(self.touch('project', 'src', 'app', 'models.py')) == 'app.models'
+
+    def test_namespace_package(self):
+        self.touch('project', 'pytest.ini')
+        test_file = self.touch('project', 'tests', 'unit', 'test_models.py')
+        assert modules.get_module(test_file) == 'tests.unit.test_models'
+
+    def test_conftest_directory(self):
+        self.touch('tests', 'conftest.py')
+        assert modules.get_module(self.touch('tests', 'test_models.py')) == 'test_models'
+
+    def test_package_init(self):
+        self.touch('project', 'app', '__init__.py')
+        path = os.path.join(self.root, 'project', 'app', '__init__.py')
+        assert modules.get_module(path) == 'app'
+
+    def test_fallback_to_base(self):
+        assert modules.get_module('/missing/project/tests/file.py', base='/missing/project') == 'tests.file'
+        assert modules.get_module('/missing/project/tests/file.py', base='/other') == ''
+        assert modules.get_module('/missing/project/tests/file.txt', base='/missing/project') == ''
+
+    def test_import_roots_are_memoized(self):
+        test_file = self.touch('project', 'tests', 'test_models.py')
+        assert modules.get_module(test_file, base=self.root) == 'project.tests.test_models'
+        self.touch('project', 'tests', '__init__.py')
+        assert modules.get_module(test_file, base=self.root) == 'project.tests.test_models'
+        modules.clear_import_roots()
+        assert modules.get_module(test_file, base=self.root) == 'tests.test_models'
@@ -0,0 +1,104 @@
+import io
+import shutil
+import sys
+import tempfile
+import time
+from unittest import TestCase, mock
+
+from . import sublime_mock  # noqa: F401
+from ..utils import output as output_module
+from ..utils.output import OutputBuffer
+
+
+class TestOutputBuffer(TestCase):
+    def test_keeps_bounded_tail(self):
+        log_file = io.StringIO()
+        log_file.name = 'full.log'
+        output = OutputBuffer(max_lines=3, collapse_passed=False, log_file=log_file)
+        output.write(''.join('line %s\n' % i for i in range(10)))
+        assert list(output.lines) == ['line 7', 'line 8', 'line 9']
+        assert output.hidden == 7
+        assert output.render().splitlines() == [
+            '[7 earlier lines hidden, see full log: full.log]',
+            'line 7', 'line 8', 'line 9',
+        ]
+        assert log_file.getvalue().count('\n') == 10
+
+    def test_joins_partial_lines(self):
+        output = OutputBuffer()
+        output.write('first li')
+        output.write('ne\nsecond')
+        assert list(output.lines) == ['first line']
+        assert output.render() == 'first line\nsecond'
+        output.close()
+        assert list(output.lines) == ['first line', 'second']
+
+    def test_collapses_passed_tests(self):
+        output = OutputBuffer()
+        output.write(
+            'tests/test_a.py::test_one PASSED   [ 33%]\n'
+            'tests/test_a.py::test_two FAILED   [ 66%]\n'
+            'test_three (tests.test_a.TestA) ... ok\n'
+        )
+        assert output.passed == 2
+        assert output.render().splitlines() == [
+            '[2 passed tests collapsed]',
+            'tests/test_a.py::test_two FAILED   [ 66%]',
+        ]
+
+    def test_strips_ansi_escapes_and_tracks_dirty(self):
+        output = OutputBuffer()
+        assert not output.dirty
+        output.write('\x1b[32mgreen\x1b[0m\r\n')
+        assert output.dirty
+        assert output.render() == 'green\n'
+        assert not output.dirty
+
+
+class TestThrottledRun(TestCase):
+    def wait(self, run):
+        for _ in range(500):
+            if run.returncode is not None:
+                return
+            time.sleep(0.01)
+        raise AssertionError('run did not finish')
+
+    def test_replaced_run_is_detached(self):
+        log_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, log_dir)
+        window = mock.Mock(id=mock.Mock(return_value=1))
+        on_finish = mock.Mock()
+        script = 'import time\nwhile True:\n    print("old", flush=True)\n    time.sleep(0.01)'
+        with mock.patch.object(output_module, 'get_cache_dir', return_value=log_dir):
+            first = output_module.ThrottledRun(window, [sys.executable, '-c', script], on_finish=on_finish)
+            first.start()
+            time.sleep(0.2)
+            second = output_module.ThrottledRun(window, [sys.executable, '-c', 'print("new")'])
+            second.start()
+        self.wait(first)
+        self.wait(second)
+
+        with open(second.log_path) as log_file:
+            assert log_file.read() == 'new\n'
+        panel = window.create_output_panel.return_value
+        panel.run_command.reset_mock()
+        first._tick()
+        assert not panel.run_command.called
+        assert not on_finish.called
+
+    def test_cancelled_run_does_not_finish(self):
+        log_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, log_dir)
+        window = mock.Mock(id=mock.Mock(return_value=2))
+        on_finish = mock.Mock()
+        with mock.patch.object(output_module, 'get_cache_dir', return_value=log_dir):
+            run = output_module.ThrottledRun(
+                window, [sys.executable, '-c', 'import time; time.sleep(10)'], on_finish=on_finish)
+            run.start()
+        run.kill()
+        self.wait(run)
+        run._tick()
+        assert run.returncode < 0
+        assert not on_finish.called
+        text = window.create_output_panel.return_value.run_command.call_args[0][1]['text']
+        assert text.endswith('[Cancelled]')
@@ -0,0 +1,71 @@
+import os
+import shutil
+import tempfile
+from unittest import TestCase
+
+from . import sublime_mock  # noqa: F401
+from ..utils.result_cache import ResultCache, source_hashes
+
+
+def write(path, content):
+    if not os.path.exists(os.path.dirname(path)):
+        os.makedirs(os.path.dirname(path))
+    with open(path, 'w') as f:
+        f.write(content)
+
+
+class TestResultCache(TestCase):
+    def setUp(self):
+        self.root = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.root)
+        self.test_file = os.path.join(self.root, 'tests', 'test_app.py')
+        write(os.path.join(self.root, 'app', '__init__.py'), '')
+        write(os.path.join(self.root, 'app', 'models.py'), 'from . import utils\n')
+        write(os.path.join(self.root, 'app', 'utils.py'), 'import os\n')
+        write(os.path.join(self.root, 'app', 'unrelated.py'), '')
+        write(os.path.join(self.root, 'tests', 'conftest.py'), '')
+        write(self.test_file, 'from app.models import Model\n')
+        self.cache = ResultCache(os.path.join(self.root, 'results.json'))
+
+    def key(self):
+        return self.cache.key('pytest test_app.py', self.test_file, [self.root], {})
+
+    def test_source_hashes_follow_project_imports(self):
+        hashes = source_hashes(self.test_file, [self.root])
+        assert sorted(os.path.relpath(path, self.root) for path in hashes) == [
+            os.path.join('app', '__init__.py'),
+            os.path.join('app', 'models.py'),
+            os.path.join('app', 'utils.py'),
+            os.path.join('tests', 'conftest.py'),
+            os.path.join('tests', 'test_app.py'),
+        ]
+
+    def test_key_changes_with_imported_modules_only(self):
+        key = self.key()
+        write(os.path.join(self.root, 'app', 'unrelated.py'), 'x = 1\n')
+        assert self.key() == key
+        write(os.path.join(self.root, 'app', 'utils.py'), 'import sys\n')
+        assert self.key() != key
+
+    def test_only_passing_results_are_cached(self):
+        key = self.key()
+        self.cache.record('test', key, 1, 'failed')
+        assert self.cache.get('test', key) is None
+        self.cache.record('other', 'other key', 0, 'passed')
+        assert self.cache.get('other', 'other key')['output'] == 'passed'
+
+        # reloaded from disk
+        cache = ResultCache(self.cache.path)
+        assert cache.get('other', 'other key')['output'] == 'passed'
+
+    def test_flaky_results_are_not_cached(self):
+        self.cache.record('test', 'key', 0, 'passed')
+        self.cache.record('test', 'key', 1, 'failed')
+        self.cache.record('test', 'key', 0, 'passed')
+        assert self.cache.get('test', 'key') is None
+        assert self.cache.flaky == {'test'}
+
+        assert self.cache.clear_flaky() == 1
+        self.cache.record('test', 'key', 0, 'passed')
+        assert self.cache.get('test', 'key')['output'] == 'passed'
+        assert ResultCache(self.cache.path).flaky == set()
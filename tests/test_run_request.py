@@ -0,0 +1,119 @@
+import os
+import tempfile
+import threading
+from unittest import TestCase, mock
+
+from . import sublime_mock  # noqa: F401
+from ..utils import run_request
+
+SETTINGS = dict(
+    run_request.SETTINGS_DEFAULTS, default_cmd=['pytest', '{filename}::{test_class}::{test_func}'])
+WINDOW = run_request.WindowState(
+    project_path='', project_base_name='', folders=(), packages=frozenset())
+
+
+def build(filename='test_file.py', test_class='TestCase', test_func='test_a', selection='',
+          settings=SETTINGS, **command_kwargs):
+    view_state = run_request.ViewState(filename, test_class, test_func, selection)
+    return run_request.build_run_request(view_state, WINDOW, settings, command_kwargs)
+
+
+class TestBuildRunRequest(TestCase):
+    def test_request(self):
+        request = build(env={'PATH': '/bin'}, working_dir='/tests', file_regex='^(.*)$')
+        assert request.cmd == ('pytest', 'test_file.py::TestCase::test_a')
+        assert request.exec_kwargs() == dict(
+            cmd=['pytest', 'test_file.py::TestCase::test_a'],
+            env={'PATH': '/bin:%s' % os.environ['PATH']},
+            working_dir='/tests', file_regex='^(.*)$')
+        assert request.external is None
+        assert request.run_dir == '/tests'
+
+    def test_settings_and_kwargs_are_not_modified(self):
+        settings = dict(SETTINGS, default_cmd=['pytest'])
+        command_kwargs = {'extra_cmd_args': ['-x'], 'env': {'PATH': '/bin'}}
+        request = build(settings=settings, **command_kwargs)
+        assert request.cmd == ('pytest', '-x')
+        assert settings['default_cmd'] == ['pytest']
+        assert command_kwargs == {'extra_cmd_args': ['-x'], 'env': {'PATH': '/bin'}}
+
+    def test_default_external(self):
+        settings = dict(SETTINGS, default_external=['xterm', '-e'])
+        assert build(external=True, settings=settings).external == ('xterm', '-e')
+        assert build(external=True).external is True
+        assert build(external='tmux').external == 'tmux'
+
+    def test_shell_command(self):
+        request = build(filename='/my tests/test_file.py', env={'PATH': '/bin'})
+        assert request.shell_command() == (
+            "cd '/my tests' && PATH=%s pytest "
+            "'/my tests/test_file.py::TestCase::test_a'" % ('/bin:' + os.environ['PATH']))
+
+    def test_shell_command_inheriting_path(self):
+        root = tempfile.mkdtemp()
+        self.addCleanup(os.rmdir, root)
+        filename = os.path.join(root, 'test_file.py')
+        request = build(filename=filename, env={'PATH': '/venv/bin', 'DEBUG': 'a b'})
+        assert request.shell_command(inherit_path=True) == (
+            "cd %s && DEBUG='a b' PATH=/venv/bin:\"$PATH\" pytest %s::TestCase::test_a" % (root, filename))
+        # Sublime's PATH isn't set when none is configured
+        request = build(filename=filename)
+        assert request.shell_command(inherit_path=True) == (
+            "cd %s && pytest %s::TestCase::test_a" % (root, filename))
+
+    def test_concurrent_builds(self):
+        requests = {}
+
+        def build_in_thread(index):
+            requests[index] = build(test_func='test_%s' % index)
+
+        threads = [threading.Thread(target=build_in_thread, args=(i, )) for i in range(8)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        assert sorted(request.test_func for request in requests.values()) == [
+            'test_%s' % i for i in range(8)]
+
+
+class TestRequestCache(TestCase):
+    def test_bounded(self):
+        cache = run_request.RequestCache(max_size=2)
+        cache.put('a', 1)
+        cache.put('b', 2)
+        assert cache.get('a') == 1
+        cache.put('c', 3)
+        # the least recently used request is dropped
+        assert cache.get('b') is None
+        assert (cache.get('a'), cache.get('c')) == (1, 3)
+
+    def test_key(self):
+        view = mock.Mock()
+        view.sel.return_value = [mock.Mock(a=1, b=3)]
+        view.id.return_value = 7
+        view.change_count.return_value = 2
+        view.file_name.return_value = '/project/test_old.py'
+        window_state = run_request.WindowState('/project', 'project', ('/project', ), frozenset())
+        key = run_request.request_key(view, window_state, {'cmd': ['pytest']})
+        assert key == run_request.request_key(view, window_state, {'cmd': ['pytest']})
+        assert key != run_request.request_key(view, window_state, {'cmd': ['nosetests']})
+
+        view.change_count.return_value = 3
+        assert key != run_request.request_key(view, window_state, {'cmd': ['pytest']})
+        view.change_count.return_value = 2
+
+        # renamed (or saved as) without editing
+        view.file_name.return_value = '/project/test_new.py'
+        assert key != run_request.request_key(view, window_state, {'cmd': ['pytest']})
+        view.file_name.return_value = '/project/test_old.py'
+
+        other_project = window_state._replace(folders=('/project', '/other'))
+        assert key != run_request.request_key(view, other_project, {'cmd': ['pytest']})
+        ansi_installed = window_state._replace(packages=frozenset(['sublimeansi']))
+        assert key != run_request.request_key(view, ansi_installed, {'cmd': ['pytest']})
+
+        run_request.bump_revision()
+        assert key != run_request.request_key(view, window_state, {'cmd': ['pytest']})
+
+        view.sel.return_value = []
+        assert run_request.request_key(view, window_state, {}) is None
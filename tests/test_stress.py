@@ -0,0 +1,65 @@
+import sys
+from unittest import TestCase, mock
+
+from . import sublime_mock  # noqa: F401
+from ..utils import stress
+
+# fails for odd seeds, printing its (own) temporary directory
+SCRIPT = """
+import os, sys, tempfile
+print(tempfile.gettempdir())
+sys.exit(int(os.environ['TEST_PLIER_SEED']) % 2)
+"""
+
+
+class TestStressReport(TestCase):
+    def test_percentile(self):
+        values = [float(value) for value in range(1, 11)]
+        assert stress.percentile(values, 50) == 5
+        assert stress.percentile(values, 90) == 9
+        assert stress.percentile(values, 99) == 10
+        assert stress.percentile([3.0], 50) == 3
+
+    def test_seed_for(self):
+        assert stress.seed_for(None, 3) is None
+        assert stress.seed_for(10, 3) == 13
+        assert stress.seed_for(2 ** 32 - 1, 1) == 0
+        assert 0 <= stress.seed_for(True, 0) < 2 ** 32
+
+    def test_format_report(self):
+        results = [
+            stress.StressResult(0, 0, 1.0, 'ok', None),
+            stress.StressResult(2, 1, 3.0, 'failed!', None),
+            stress.StressResult(1, 1, 2.0, 'failed again', None),
+        ]
+        assert stress.format_report(results, 4).splitlines() == [
+            'Stress run: 3/4 runs, 1 passed, 2 failed',
+            'Stopped after the first failure (1 runs skipped or cancelled)',
+            'Durations: min 1.00s, p50 2.00s, p90 3.00s, p99 3.00s, max 3.00s',
+            '',
+            'First failure (run 3, exit code 1):',
+            'failed!',
+        ]
+
+
+class TestStressRun(TestCase):
+    def stress_run(self, script, **options):
+        options = stress.StressOptions(**dict(dict(runs=6, fail_fast=False, seed=None), **options))
+        run = stress.StressRun(mock.Mock(), [sys.executable, '-c', script], options, jobs=3)
+        return run, run.run()
+
+    def test_runs(self):
+        run, report = self.stress_run(SCRIPT, seed=100)
+        assert len(run.results) == 6
+        assert sorted(result.seed for result in run.results) == list(range(100, 106))
+        assert sorted(result.returncode for result in run.results) == [0, 0, 0, 1, 1, 1]
+        assert report.startswith('Stress run: 6/6 runs, 3 passed, 3 failed\n')
+        assert 'Seeds of failed runs: ' in report
+        # each run has a temporary directory of its own
+        assert len(set(result.output for result in run.results)) == 6
+
+    def test_fail_fast(self):
+        run, report = self.stress_run('import sys; sys.exit(3)', runs=20, fail_fast=True)
+        assert len(run.results) < 20
+        assert [result.returncode for result in run.results] == [3]
+        assert 'Stopped after the first failure' in report
@@ -0,0 +1,84 @@
+import re
+from os import path
+from unittest import TestCase
+
+from . import sublime_mock  # noqa: F401
+from .. import test_parser
+from ..utils.symbols import get_test_from_symbols
+
+FIXTURE = path.join(path.abspath(path.dirname(__file__)), '_fixture.py')
+
+
+class Region(object):
+    def __init__(self, a, b):
+        self.a, self.b = a, b
+
+    def begin(self):
+        return min(self.a, self.b)
+
+
+class Symbol(object):
+    def __init__(self, region):
+        self.region = region
+
+
+class FakeView(object):
+    """ A view of given source, with symbols of classes/functions """
+
+    def __init__(self, source):
+        self.source = source
+        self.scopes = {}
+        for kind, keyword in (('class', 'class'), ('function', 'def')):
+            for match in re.finditer(r'^[ \t]*%s\s+(\w+)' % keyword, source, re.M):
+                self.scopes[match.start(1)] = 'entity.name.%s.python' % kind
+        self.copied = []
+
+    def indexed_symbol_regions(self):
+        return [Symbol(Region(point, point + 1)) for point in sorted(self.scopes)]
+
+    def symbol_regions(self):
+        return self.indexed_symbol_regions()
+
+    def find_by_selector(self, selector):
+        return [region.region for region in self.indexed_symbol_regions()]
+
+    def rowcol(self, point):
+        return self.source.count('\n', 0, point), point - self.source.rfind('\n', 0, point) - 1
+
+    def line(self, region):
+        end = self.source.find('\n', region.begin())
+        return Region(self.source.rfind('\n', 0, region.begin()) + 1,
+                      len(self.source) if end == -1 else end)
+
+    def substr(self, region):
+        self.copied.append(region.b - region.a)
+        return self.source[region.a:region.b]
+
+    def match_selector(self, point, selector):
+        return self.scopes.get(point, '').startswith(selector)
+
+
+class TestSymbols(TestCase):
+    def setUp(self):
+        with open(FIXTURE) as fixture:
+            self.source = fixture.read()
+        self.view = FakeView(self.source)
+
+    def test_same_as_test_parser(self):
+        for ignore_bases in ([], ['object']):
+            parser = test_parser.TestParser(self.source, ignore_bases=ignore_bases)
+            for line in range(1, self.source.count('\n') + 2):
+                assert get_test_from_symbols(self.view, line, ignore_bases=ignore_bases) == \
+                    parser.parse(line), 'line %s' % line
+        # only the definition lines were read
+        assert max(self.view.copied) < 50
+
+    def test_no_symbols(self):
+        assert get_test_from_symbols(FakeView('x = 1\n'), 1) is None
+
+    def test_ambiguous_definitions(self):
+        view = FakeView('class TestCase(Base):\n    def test_method(\n            self):\n        pass\n')
+        assert get_test_from_symbols(view, 1) == ('TestCase', None)
+        assert get_test_from_symbols(view, 4) is None
+        view = FakeView('class TestCase(\n        Base):\n    pass\n')
+        assert get_test_from_symbols(view, 3) is None
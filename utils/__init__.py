@@ -3,8 +3,11 @@ Utilities for parsing text position in python code, through AST,
 and returning a test class/method name.
 """
 from __future__ import print_function
+from contextlib import contextmanager
+import json
 import os
 import subprocess
+import time
 
 import sublime
 
@@ -38,6 +41,56 @@ def _log(*args, **kwargs):
     print(*args)
 
 
+@contextmanager
+def timed(label):
+    """ Log the time it took to run the wrapped block (in debug mode) """
+    start = time.time()
+    yield
+    _log('%s took %.1fms' % (label, (time.time() - start) * 1000))
+
+
+_installed_packages = None
+
+
+def _packages_mtimes():
+    """ The mtimes of the packages directories, which change as packages are (un)installed """
+    mtimes = []
+    for path in (sublime.installed_packages_path(), sublime.packages_path()):
+        try:
+            mtimes.append(os.stat(path).st_mtime)
+        except OSError:
+            mtimes.append(None)
+    return tuple(mtimes)
+
+
+def get_installed_packages(refresh=False):
+    """
+    Return the (lowercase) names of installed packages; memoized until
+    packages are installed or removed.
+    """
+    global _installed_packages
+    mtimes = _packages_mtimes()
+    if _installed_packages is None or refresh or _installed_packages[0] != mtimes:
+        installed_packages = [
+            filename.split('.')[0]
+            for filename
+            in os.listdir(sublime.installed_packages_path())
+        ]
+        local_packages = os.listdir(sublime.packages_path())
+        _installed_packages = (mtimes, set(
+            package.lower() for package in installed_packages + local_packages
+        ))
+    return _installed_packages[1]
+
+
+def get_cache_dir(*parts):
+    """ Return (and create) a directory for the plugin's cached files """
+    cache_dir = os.path.join(sublime.cache_path(), "SublimeTestPlier", *parts)
+    if not os.path.exists(cache_dir):
+        os.makedirs(cache_dir)
+    return cache_dir
+
+
 def get_first_selection(view):
     view.settings().set('__vi_external_disable', True)
     selection = list(view.sel())
@@ -62,10 +115,27 @@ def get_selection_content(view):
         return selected_string
 
 
+def get_tests_external_python(python, queries, jobs=1):
+    """
+    Resolve many (filename, line) queries in a single call to the given
+    python executable, returning a (class, function) tuple for each query.
+    """
+    args = [python, os.path.abspath(test_parser.__file__), '--json', '--jobs', str(jobs)]
+    stdin = ''.join(
+        json.dumps({'file': filename, 'line': line}) + '\n' for filename, line in queries)
+    process = subprocess.Popen(args, stdin=subprocess.PIPE, stdout=subprocess.PIPE)
+    output, _ = process.communicate(stdin.encode('utf8'))
+    if process.returncode:
+        raise subprocess.CalledProcessError(process.returncode, args, output)
+    results = [json.loads(line) for line in output.decode('utf8').splitlines() if line.strip()]
+    for result in results:
+        if 'error' in result:
+            _log('Failed to parse %(file)s: %(error)s' % result)
+    return [(result.get('class'), result.get('function')) for result in results]
+
+
 def get_test_external_python(python, filename, line):
-    args = [python, os.path.abspath(test_parser.__file__), filename, str(line)]
-    output = subprocess.check_output(args)
-    return tuple((part.decode('utf8') for part in output.strip().split(b',')))
+    return get_tests_external_python(python, [(filename, line)])[0]
 
 
 def get_test(view, use_python=None):
@@ -78,26 +148,46 @@ def get_test(view, use_python=None):
         _log("No selection found: ", r)
         return
 
-    # try to detect if r is inside class/method
-    source = view.substr(sublime.Region(0, view.size()))
-    _log("source is: ", source)
     line, col = view.rowcol(int(r.a))
     line = line + 1
     assert line, ('No line found in region: %s' % r)
     _log('Position in code -> line %s' % line)
 
+    # try the editor's symbols first, which doesn't require copying the source
+    from .symbols import get_test_from_symbols
+    result = get_test_from_symbols(view, line, ignore_bases=['object'])
+    if result is not None:
+        _log('Found class/name (from symbols): %s/%s' % result)
+        return result
+
+    # try to detect if r is inside class/method
     if use_python:
         filename = view.file_name()
         assert filename, 'Cannot use_python without a filename'
         class_name, method_name = get_test_external_python(use_python, filename, line)
     else:
+        source = view.substr(sublime.Region(0, view.size()))
+        _log("source is: ", source)
         parser = test_parser.TestParser(source, debug=DEBUG(), ignore_bases=['object'])
         class_name, method_name = parser.parse(line)
     _log('Found class/name: %s/%s' % (class_name, method_name))
     return class_name, method_name
 
 
+_external_command = None
+
+
 def get_default_command():
+    return _external_command or provision_external_scripts()
+
+
+def provision_external_scripts():
+    """
+    Copy the external scripts to the user dir (once) to expose them to the
+    system, and return the command to run them.
+    """
+    global _external_command
+
     ITERM_SCRIPT = b"""-- iTerm3 applescript launcher
 set test_cmd to system attribute "TEST_CMD"
 
@@ -156,4 +246,5 @@ if __name__ == '__main__':
         with open(python_script_full_path, "wb") as out_f:
             out_f.write(PYTHON_SCRIPT)
 
-    return ["python", python_script_full_path]
+    _external_command = ["python", python_script_full_path]
+    return _external_command
@@ -0,0 +1,248 @@
+"""
+A cache of the test node ids pytest collects from each test module of a
+project, used to resolve `-k {selection}` into explicit node ids; so pytest
+only imports and collects the modules which actually run.
+
+Node ids are collected in the background (using `pytest --collect-only -q`,
+ignoring the project's `addopts`, which may change the output format) and
+stored on disk with the mtime of each module. Only modules which changed
+(or are below a changed conftest.py) are collected again.
+"""
+import hashlib
+import json
+import os
+import re
+import subprocess
+import threading
+
+from . import _log, get_cache_dir
+from .fixtures import is_test_file, SKIP_DIRS
+
+MYPY = False
+if MYPY:
+    from typing import Callable, Dict, List, Optional, Tuple
+
+# `-o addopts=` drops the project's options (e.g `-v`) which would undo `-q`
+COLLECT_ARGS = [
+    '--collect-only', '-q', '-o', 'addopts=', '--continue-on-collection-errors', '-p', 'no:cacheprovider']
+COLLECT_TIMEOUT = 120
+# collect the whole project rather than passing more modules than this
+MAX_COLLECT_ARGS = 100
+# pytest exit codes of a complete collection (some tests, or none collected)
+COLLECTED = (0, 5)
+# only plain names (not expressions) are resolved
+SIMPLE_SELECTION = re.compile(r'^[\w.\[\]-]+$')
+EXPRESSION_KEYWORDS = ('and', 'or', 'not')
+PYTEST_NAMES = ('pytest', 'py.test')
+# e.g `4 tests collected in 0.01s`, `3/4 tests collected (1 deselected)` or `collected 4 items`
+COLLECTED_COUNT = re.compile(r'\b(?:(\d+)(?:/\d+)? tests? collected|collected (\d+) items?)\b')
+
+
+def pytest_command(cmd):
+    # type: (List[str]) -> Optional[List[str]]
+    """ The part of a command running pytest (e.g `python -m pytest`), if any """
+    if cmd and os.path.basename(cmd[0]) in PYTEST_NAMES:
+        return cmd[:1]
+    if len(cmd) > 2 and cmd[1:3] == ['-m', 'pytest']:
+        return cmd[:3]
+    return None
+
+
+def parse_collect_output(output):
+    # type: (str) -> List[str]
+    """ Return the node ids listed by `pytest --collect-only -q` """
+    node_ids = []
+    for line in output.splitlines():
+        if not line.strip():
+            break  # the summary (and errors) follow the list of node ids
+        if '::' in line and not line[0].isspace():
+            node_ids.append(line.strip())
+    return node_ids
+
+
+def parse_collected_count(output):
+    # type: (str) -> Optional[int]
+    """ The number of tests pytest reported as collected, if any """
+    found = COLLECTED_COUNT.findall(output)
+    if not found:
+        return None
+    return int(found[-1][0] or found[-1][1])
+
+
+def collect(pytest_cmd, paths, root, env=None):
+    # type: (List[str], List[str], str, Optional[Dict[str, str]]) -> Tuple[Optional[List[str]], Optional[int]]
+    """ Collect the node ids of given paths, return them and pytest's exit code """
+    cmd = list(pytest_cmd) + COLLECT_ARGS + ['--rootdir', root] + list(paths)
+    _log('Collecting tests: ', cmd)
+    try:
+        proc = subprocess.Popen(
+            cmd, cwd=root, env=env, stdout=subprocess.PIPE, stderr=subprocess.STDOUT)
+    except OSError as e:
+        _log('Failed to collect tests: ', e)
+        return None, None
+    try:
+        output, _ = proc.communicate(timeout=COLLECT_TIMEOUT)
+    except subprocess.TimeoutExpired:
+        proc.kill()
+        proc.communicate()
+        _log('Collecting tests timed out')
+        return None, None
+    output = output.decode('utf8', 'replace')
+    node_ids = parse_collect_output(output)
+    if not node_ids and parse_collected_count(output):
+        # tests were collected, but not listed in the format we expect
+        _log('Failed to parse the collected tests: ', output)
+        return None, None
+    return node_ids, proc.returncode
+
+
+def matches(selection, names):
+    # type: (str, List[str]) -> bool
+    """ Whether a plain `-k` selection matches any of the names of a test """
+    selection = selection.lower()
+    return any(selection in name.lower() for name in names)
+
+
+def is_simple_selection(selection):
+    # type: (str) -> bool
+    return bool(SIMPLE_SELECTION.match(selection)) and selection not in EXPRESSION_KEYWORDS
+
+
+class CollectionCache(object):
+    """ Node ids of all test modules under `root`, by file path """
+
+    def __init__(self, root, cache_path=None):
+        self.root = os.path.abspath(root)
+        self.cache_path = cache_path
+        self.files = {}  # type: Dict[str, dict]
+        self.conftests = {}  # type: Dict[str, float]
+        if cache_path and os.path.exists(cache_path):
+            try:
+                with open(cache_path) as cache_file:
+                    data = json.load(cache_file)
+            except (IOError, ValueError):
+                data = {}
+            if data.get('root') == self.root:
+                self.files = data.get('files', {})
+                self.conftests = data.get('conftests', {})
+
+    def scan(self):
+        # type: () -> Tuple[Dict[str, float], Dict[str, float]]
+        """ Return the mtimes of the test modules and conftest.py files """
+        modules, conftests = {}, {}
+        for dirpath, dirnames, filenames in os.walk(self.root):
+            dirnames[:] = [
+                dirname for dirname in dirnames
+                if not dirname.startswith('.') and dirname not in SKIP_DIRS]
+            for filename in filenames:
+                if is_test_file(filename):
+                    path = os.path.join(dirpath, filename)
+                    found = conftests if filename == 'conftest.py' else modules
+                    found[path] = os.path.getmtime(path)
+        return modules, conftests
+
+    def refresh(self, pytest_cmd, env=None):
+        # type: (List[str], Optional[Dict[str, str]]) -> bool
+        """ Collect the modules which changed since the last refresh """
+        modules, conftests = self.scan()
+        changed_dirs = [
+            os.path.join(os.path.dirname(path), '')
+            for path, mtime in conftests.items() if self.conftests.get(path) != mtime]
+        stale = sorted(
+            path for path, mtime in modules.items()
+            if self.files.get(path, {}).get('mtime') != mtime or
+            any(path.startswith(dirname) for dirname in changed_dirs))
+        files = dict((path, entry) for path, entry in self.files.items() if path in modules)
+        if not stale and len(files) == len(self.files) and conftests == self.conftests:
+            return False
+
+        if stale:
+            args = [self.root] if len(stale) > MAX_COLLECT_ARGS else stale
+            node_ids, returncode = collect(pytest_cmd, args, self.root, env)
+            if node_ids is None:
+                return False
+            collected = {}  # type: Dict[str, List[str]]
+            for node_id in node_ids:
+                path, _, name = node_id.partition('::')
+                collected.setdefault(os.path.normpath(os.path.join(self.root, path)), []).append(name)
+            for path in stale:
+                if path in collected or returncode in COLLECTED:
+                    files[path] = {'mtime': modules[path], 'node_ids': collected.get(path, [])}
+                else:
+                    # failed to collect (e.g an import error), try again next time
+                    files.pop(path, None)
+
+        # a new dict is swapped in, so readers never see a partial update
+        self.files = files
+        self.conftests = conftests
+        self.save()
+        return True
+
+    def save(self):
+        if not self.cache_path:
+            return
+        with open(self.cache_path, 'w') as cache_file:
+            json.dump({'root': self.root, 'files': self.files, 'conftests': self.conftests}, cache_file)
+
+    def node_ids(self, path):
+        # type: (str) -> Optional[List[str]]
+        """ The node ids (without the path) of a module, or None if stale """
+        entry = self.files.get(path)
+        if not entry or not os.path.exists(path) or entry['mtime'] != os.path.getmtime(path):
+            return None
+        return entry['node_ids']
+
+    def resolve(self, path, selection, test_class=None, test_func=None):
+        # type: (str, str, Optional[str], Optional[str]) -> Optional[List[str]]
+        """
+        Return the node ids of given module (and class/function) matching a
+        plain `-k` selection, or None if they cannot be resolved.
+        """
+        node_ids = self.node_ids(path)
+        if node_ids is None or not is_simple_selection(selection):
+            return None
+        prefix = '::'.join(name for name in (test_class, test_func) if name)
+        # like -k, match the names of the test, its classes, module and packages
+        parents = os.path.relpath(path, self.root).split(os.path.sep)
+        return [
+            node_id for node_id in node_ids
+            if (not prefix or node_id == prefix or node_id.startswith(prefix + '::') or
+                node_id.startswith(prefix + '[')) and
+            matches(selection, parents + node_id.split('::'))
+        ]
+
+
+_collections = {}  # type: Dict[str, CollectionCache]
+_collections_lock = threading.Lock()
+_refreshing = set()
+
+
+def get_collection(root):
+    # type: (str) -> CollectionCache
+    """ Return the collection cache of a project root (as last refreshed) """
+    root = os.path.abspath(root)
+    with _collections_lock:
+        if root not in _collections:
+            cache_name = '%s.json' % hashlib.sha1(root.encode('utf8')).hexdigest()
+            _collections[root] = CollectionCache(root, os.path.join(get_cache_dir('collection'), cache_name))
+        return _collections[root]
+
+
+def refresh_async(root, pytest_cmd, env=None, on_change=None):
+    # type: (str, List[str], Optional[Dict[str, str]], Optional[Callable[[], None]]) -> None
+    """ Refresh the collection of a project in the background (once at a time) """
+    root = os.path.abspath(root)
+    with _collections_lock:
+        if root in _refreshing:
+            return
+        _refreshing.add(root)
+
+    def refresh():
+        try:
+            if get_collection(root).refresh(pytest_cmd, env) and on_change:
+                on_change()
+        finally:
+            with _collections_lock:
+                _refreshing.discard(root)
+
+    threading.Thread(target=refresh).start()
@@ -0,0 +1,340 @@
+"""
+A static index of pytest fixtures and the tests that use them, used to run
+all tests depending on the fixture under the cursor.
+
+Test modules and conftest.py files are parsed (using AST) for fixture
+definitions and the fixtures requested by tests and fixtures (arguments,
+`usefixtures` marks and autouse fixtures). Fixtures are looked up the way
+pytest does: in the test class, the test module, then the conftest.py files
+of its directory and its parents. The index is stored on disk, and only
+files whose mtime changed are parsed again.
+"""
+import ast
+import hashlib
+import json
+import os
+import threading
+
+from . import _log, get_cache_dir
+
+MYPY = False
+if MYPY:
+    from typing import Dict, List, Optional, Set, Tuple
+
+SKIP_DIRS = ('node_modules', '__pycache__', 'venv', 'env', 'build', 'dist', 'site-packages')
+
+
+def is_test_file(filename):
+    # type: (str) -> bool
+    return filename == 'conftest.py' or filename.endswith('.py') and (
+        filename.startswith('test_') or filename.endswith('_test.py'))
+
+
+def _decorator_name(node):
+    # type: (ast.AST) -> Optional[str]
+    if isinstance(node, ast.Call):
+        node = node.func
+    if isinstance(node, ast.Attribute):
+        return node.attr
+    if isinstance(node, ast.Name):
+        return node.id
+    return None
+
+
+def _string_values(nodes):
+    # type: (List[ast.AST]) -> List[str]
+    values = []
+    for node in nodes:
+        value = getattr(node, 's', getattr(node, 'value', None))
+        if isinstance(value, str):
+            values.append(value)
+    return values
+
+
+def _used_fixtures(decorators):
+    # type: (List[ast.AST]) -> List[str]
+    """ Fixture names of `usefixtures` marks in given decorators (or marks) """
+    names = []
+    for node in decorators:
+        if isinstance(node, (ast.List, ast.Tuple)):
+            names.extend(_used_fixtures(node.elts))
+        elif isinstance(node, ast.Call) and _decorator_name(node) == 'usefixtures':
+            names.extend(_string_values(node.args))
+    return names
+
+
+def _is_true(node):
+    # type: (Optional[ast.AST]) -> bool
+    """ Whether a node is the `True` constant (a plain name before python 3.4) """
+    if isinstance(node, ast.Name):
+        return node.id == 'True'
+    return getattr(node, 'value', None) is True
+
+
+def _fixture_decorator(node):
+    # type: (ast.FunctionDef) -> Optional[ast.AST]
+    for decorator in node.decorator_list:
+        if _decorator_name(decorator) == 'fixture':
+            return decorator
+    return None
+
+
+def _requested(node, is_method):
+    # type: (ast.FunctionDef, bool) -> List[str]
+    """ Names of the fixtures requested by a function's arguments """
+    args = node.args.args[1:] if is_method else node.args.args
+    # arguments with default values aren't fixtures
+    args = args[:len(args) - len(node.args.defaults)]
+    names = [getattr(arg, 'arg', getattr(arg, 'id', None)) for arg in args]
+    names.extend(
+        arg.arg for arg, default
+        in zip(getattr(node.args, 'kwonlyargs', []), getattr(node.args, 'kw_defaults', []))
+        if default is None)
+    return names
+
+
+def parse_fixtures(source):
+    # type: (str) -> dict
+    """
+    Return the fixtures defined and the tests found in given module source.
+    Fixtures are keyed by "<class>::<name>" (the class is empty for module
+    level fixtures).
+    """
+    tree = ast.parse(source)
+    fixtures = {}
+    tests = []
+    module_marks = []
+    function_types = tuple(
+        getattr(ast, name) for name in ('FunctionDef', 'AsyncFunctionDef') if hasattr(ast, name))
+
+    def visit_function(node, class_name=None, class_marks=()):
+        decorator = _fixture_decorator(node)
+        if decorator is not None:
+            keywords = dict(
+                (keyword.arg, keyword.value) for keyword in getattr(decorator, 'keywords', []))
+            name = _string_values([keywords['name']]) if 'name' in keywords else []
+            autouse = keywords.get('autouse')
+            fixture = {
+                'name': name[0] if name else node.name,
+                'func': node.name,
+                'class': class_name,
+                'requests': _requested(node, is_method=bool(class_name)),
+                'autouse': _is_true(autouse),
+            }
+            fixtures['%s::%s' % (class_name or '', fixture['name'])] = fixture
+        elif node.name.startswith('test'):
+            tests.append({
+                'class': class_name,
+                'func': node.name,
+                'requests': (
+                    _requested(node, is_method=bool(class_name)) +
+                    _used_fixtures(node.decorator_list) + list(class_marks)),
+            })
+
+    for node in tree.body:
+        if isinstance(node, ast.Assign) and any(
+                getattr(target, 'id', None) == 'pytestmark' for target in node.targets):
+            module_marks.extend(_used_fixtures([node.value]))
+
+    for node in tree.body:
+        if isinstance(node, function_types):
+            visit_function(node)
+        elif isinstance(node, ast.ClassDef) and node.name.startswith('Test'):
+            class_marks = _used_fixtures(node.decorator_list)
+            for item in node.body:
+                if isinstance(item, ast.Assign) and any(
+                        getattr(target, 'id', None) == 'pytestmark' for target in item.targets):
+                    class_marks.extend(_used_fixtures([item.value]))
+            for item in node.body:
+                if isinstance(item, function_types):
+                    visit_function(item, class_name=node.name, class_marks=class_marks + module_marks)
+
+    for test in tests:
+        if test['class'] is None:
+            test['requests'].extend(module_marks)
+    return {'fixtures': fixtures, 'tests': tests}
+
+
+def is_fixture(path, class_name, func_name):
+    # type: (str, Optional[str], str) -> bool
+    """ Whether given function of a module defines a fixture """
+    try:
+        with open(path, 'rb') as source_file:
+            fixtures = parse_fixtures(source_file.read())['fixtures']
+    except (IOError, SyntaxError, ValueError):
+        return False
+    return any(
+        fixture['func'] == func_name and fixture['class'] == class_name
+        for fixture in fixtures.values())
+
+
+class FixtureIndex(object):
+    """ Fixtures and tests of all test modules under `root`, by file path """
+
+    def __init__(self, root, cache_path=None):
+        self.root = os.path.abspath(root)
+        self.cache_path = cache_path
+        self.files = {}  # type: Dict[str, dict]
+        if cache_path and os.path.exists(cache_path):
+            try:
+                with open(cache_path) as cache_file:
+                    data = json.load(cache_file)
+            except (IOError, ValueError):
+                data = {}
+            if data.get('root') == self.root:
+                self.files = data.get('files', {})
+
+    def update(self):
+        """ (Re-)parse test modules which changed since the last update """
+        # changes are made to a copy, so readers (of other threads) never see a partial update
+        files = dict(self.files)
+        found = set()
+        changed = False
+        for dirpath, dirnames, filenames in os.walk(self.root):
+            dirnames[:] = [
+                dirname for dirname in dirnames
+                if not dirname.startswith('.') and dirname not in SKIP_DIRS]
+            for filename in filenames:
+                if not is_test_file(filename):
+                    continue
+                path = os.path.join(dirpath, filename)
+                found.add(path)
+                mtime = os.path.getmtime(path)
+                if files.get(path, {}).get('mtime') == mtime:
+                    continue
+                _log('Indexing fixtures of ', path)
+                try:
+                    with open(path, 'rb') as source_file:
+                        parsed = parse_fixtures(source_file.read())
+                except (IOError, SyntaxError, ValueError) as e:
+                    _log('Failed to index fixtures of %s: %s' % (path, e))
+                    parsed = {'fixtures': {}, 'tests': []}
+                parsed['mtime'] = mtime
+                files[path] = parsed
+                changed = True
+        for path in set(files) - found:
+            del files[path]
+            changed = True
+        if changed:
+            self.files = files
+            self.save()
+
+    def save(self):
+        if not self.cache_path:
+            return
+        with open(self.cache_path, 'w') as cache_file:
+            json.dump({'root': self.root, 'files': self.files}, cache_file)
+
+    def _scopes(self, path, class_name=None):
+        # type: (str, Optional[str]) -> List[Tuple[str, Optional[str]]]
+        """ (file, class) scopes visible from given test module, nearest first """
+        scopes = []
+        if class_name:
+            scopes.append((path, class_name))
+        scopes.append((path, None))
+        dirname = os.path.dirname(path)
+        while dirname.startswith(self.root):
+            conftest = os.path.join(dirname, 'conftest.py')
+            if conftest != path and conftest in self.files:
+                scopes.append((conftest, None))
+            if dirname == self.root:
+                break
+            dirname = os.path.dirname(dirname)
+        return scopes
+
+    def _fixtures_in(self, scope):
+        # type: (Tuple[str, Optional[str]]) -> List[Tuple[str, dict]]
+        path, class_name = scope
+        return [
+            ('%s::%s' % (path, key), fixture)
+            for key, fixture in self.files.get(path, {}).get('fixtures', {}).items()
+            if fixture['class'] == class_name
+        ]
+
+    def lookup(self, name, path, class_name=None, requester=None):
+        # type: (str, str, Optional[str], Optional[str]) -> Optional[str]
+        """
+        Return the id of the fixture `name` visible from given test module
+        (and class). A fixture requesting its own name gets the one it
+        overrides.
+        """
+        fixture_ids = [
+            fixture_id
+            for scope in self._scopes(path, class_name)
+            for fixture_id, fixture in self._fixtures_in(scope)
+            if fixture['name'] == name
+        ]
+        if requester in fixture_ids:
+            fixture_ids = fixture_ids[fixture_ids.index(requester) + 1:]
+        return fixture_ids[0] if fixture_ids else None
+
+    def fixture(self, fixture_id):
+        # type: (str) -> Tuple[str, dict]
+        path, key = fixture_id.split('::', 1)
+        return path, self.files[path]['fixtures'][key]
+
+    def find_fixture(self, path, class_name, func_name):
+        # type: (str, Optional[str], str) -> Optional[str]
+        """ Return the id of a fixture defined by given function (if any) """
+        for key, fixture in self.files.get(path, {}).get('fixtures', {}).items():
+            if fixture['func'] == func_name and fixture['class'] == class_name:
+                return '%s::%s' % (path, key)
+        return None
+
+    def test_fixtures(self, path, test):
+        # type: (str, dict) -> Set[str]
+        """
+        Ids of all fixtures given test depends on, directly or transitively;
+        like pytest, all fixtures are looked up from the test's location.
+        """
+        requests = [(name, None) for name in test['requests']]
+        for scope in self._scopes(path, test['class']):
+            requests.extend(
+                (fixture['name'], None)
+                for fixture_id, fixture in self._fixtures_in(scope) if fixture['autouse'])
+
+        fixture_ids = set()
+        while requests:
+            name, requester = requests.pop()
+            fixture_id = self.lookup(name, path, test['class'], requester)
+            if fixture_id is None or fixture_id in fixture_ids:
+                continue
+            fixture_ids.add(fixture_id)
+            _, fixture = self.fixture(fixture_id)
+            requests.extend((request, fixture_id) for request in fixture['requests'])
+        return fixture_ids
+
+    def tests_using(self, fixture_id):
+        # type: (str) -> List[Tuple[str, Optional[str], str]]
+        """ Return the (path, class, function) of tests using given fixture """
+        fixture_path, _ = self.fixture(fixture_id)
+        if os.path.basename(fixture_path) == 'conftest.py':
+            prefix = os.path.join(os.path.dirname(fixture_path), '')
+            paths = [path for path in self.files if path.startswith(prefix)]
+        else:
+            paths = [fixture_path]
+
+        tests = []
+        for path in sorted(paths):
+            for test in self.files[path]['tests']:
+                if fixture_id in self.test_fixtures(path, test):
+                    tests.append((path, test['class'], test['func']))
+        return tests
+
+
+_indexes = {}  # type: Dict[str, FixtureIndex]
+# indexes may be used from several threads (e.g when preparing run requests)
+_indexes_lock = threading.Lock()
+
+
+def get_fixture_index(root):
+    # type: (str) -> FixtureIndex
+    """ Return the (updated) fixture index of a project root """
+    root = os.path.abspath(root)
+    with _indexes_lock:
+        if root not in _indexes:
+            cache_name = '%s.json' % hashlib.sha1(root.encode('utf8')).hexdigest()
+            _indexes[root] = FixtureIndex(root, os.path.join(get_cache_dir('fixtures'), cache_name))
+        index = _indexes[root]
+        index.update()
+    return index
@@ -0,0 +1,97 @@
+"""
+Resolve the dotted module path of a python source file, by discovering the
+directory it is imported relative to (its "import root").
+
+Import roots are memoized per directory; call `clear_import_roots()` when
+packages or project files are added or removed.
+"""
+import os
+
+from . import _log
+
+MYPY = False
+if MYPY:
+    from typing import Dict, Optional
+
+# files marking the root of a project (as used by pytest to find its rootdir)
+PROJECT_MARKERS = ('pyproject.toml', 'setup.cfg', 'pytest.ini', 'tox.ini', 'setup.py')
+CONFTEST = 'conftest.py'
+PACKAGE_MARKER = '__init__.py'
+
+_import_roots = {}  # type: Dict[str, Optional[str]]
+
+
+def clear_import_roots():
+    _import_roots.clear()
+
+
+def _find_import_root(dirname):
+    # type: (str) -> Optional[str]
+    if os.path.isfile(os.path.join(dirname, PACKAGE_MARKER)):
+        # inside a regular package: the root is the first parent that isn't one
+        parent = os.path.dirname(dirname)
+        while parent != dirname and os.path.isfile(os.path.join(parent, PACKAGE_MARKER)):
+            dirname, parent = parent, os.path.dirname(parent)
+        return parent
+
+    # a namespace package (or a plain directory): walk up to the project root,
+    # falling back to the nearest directory containing a conftest.py
+    conftest_dir = None
+    path = dirname
+    while True:
+        if any(os.path.isfile(os.path.join(path, marker)) for marker in PROJECT_MARKERS):
+            src = os.path.join(path, 'src')
+            if dirname == src or dirname.startswith(src + os.path.sep):
+                return src
+            return path
+        if conftest_dir is None and os.path.isfile(os.path.join(path, CONFTEST)):
+            conftest_dir = path
+        parent = os.path.dirname(path)
+        if parent == path:
+            return conftest_dir
+        path = parent
+
+
+def find_import_root(dirname):
+    # type: (str) -> Optional[str]
+    """
+    Return the directory modules in `dirname` are imported relative to, or
+    None if it cannot be determined.
+    """
+    dirname = os.path.abspath(dirname)
+    if dirname not in _import_roots:
+        _import_roots[dirname] = _find_import_root(dirname)
+        _log('Import root of %s is %s' % (dirname, _import_roots[dirname]))
+    return _import_roots[dirname]
+
+
+def get_module(filename, base=None, working_dir=None):
+    # type: (Optional[str], Optional[str], Optional[str]) -> str
+    """
+    Convert a filename to a dotted module path, relative to its import root,
+    or to `base` if the import root cannot be determined. When an explicit
+    `working_dir` (which the tests are run, and imported, from) contains the
+    file, it's used unless the import root is inside it.
+    """
+    if not filename or not filename.endswith('.py'):
+        _log('Cannot get module for non python-source file: ', filename)
+        return ''  # only python modules are supported
+    filename = os.path.abspath(filename)
+    root = find_import_root(os.path.dirname(filename))
+    if working_dir:
+        working_dir = os.path.join(os.path.abspath(working_dir), '')
+        if filename.startswith(working_dir) and not (
+                root and os.path.join(root, '').startswith(working_dir)):
+            root = working_dir
+    root = root or base
+    _log('Getting module for file %s relative to %s' % (filename, root))
+    if not root:
+        return ''
+    root = os.path.join(os.path.abspath(root), '')  # with a trailing separator
+    if not filename.startswith(root):
+        _log('Cannot determine module path outside of directory')
+        return ''
+    module = filename[len(root):-3].replace(os.path.sep, '.')
+    if module.endswith('.__init__'):
+        module = module[:-len('.__init__')]
+    return module
@@ -0,0 +1,271 @@
+"""
+A throttled, bounded replacement for the built-in `exec` output panel.
+
+Test runs that print a lot of output make the `exec` panel grow without
+limit, since every chunk is inserted into the view. Here the process output
+is read on a background thread into an `OutputBuffer`, which keeps only a
+bounded tail of lines (passing test lines are collapsed into a counter), and
+the panel is redrawn on a timer. The complete output is written to a log
+file, which can be opened using the `test_plier_open_log` command.
+"""
+import codecs
+import collections
+import os
+import re
+import subprocess
+import threading
+import time
+
+import sublime
+import sublime_plugin
+
+from . import _log, get_cache_dir
+
+MYPY = False
+if MYPY:
+    from typing import Callable, Dict, Optional
+
+PANEL_NAME = 'exec'
+ANSI_ESCAPE = re.compile(r'\x1b\[[0-9;?]*[A-Za-z]')
+# pytest/nose/unittest verbose lines of passing tests
+PASSED_LINE = re.compile(r'(\sPASSED\b|\.\.\. ok$)')
+
+# running processes and full output logs, by window id
+_runs = {}  # type: Dict[int, ThrottledRun]
+_logs = {}  # type: Dict[int, str]
+
+
+def create_panel(window, syntax=None):
+    # type: (sublime.Window, Optional[str]) -> sublime.View
+    panel = window.create_output_panel(PANEL_NAME)
+    panel_settings = panel.settings()
+    panel_settings.set('line_numbers', False)
+    panel_settings.set('gutter', False)
+    panel_settings.set('word_wrap', False)
+    panel_settings.set('scroll_past_end', False)
+    if syntax:
+        panel.assign_syntax(syntax)
+    window.run_command('show_panel', {'panel': 'output.%s' % PANEL_NAME})
+    return panel
+
+
+def show_output(window, text, syntax=None):
+    # type: (sublime.Window, str, Optional[str]) -> None
+    """ Show given text in the output panel (e.g a cached result) """
+    panel = create_panel(window, syntax=syntax)
+    panel.run_command('test_plier_replace_panel', {'text': text})
+
+
+class OutputBuffer(object):
+    """
+    Thread-safe buffer holding the last `max_lines` lines of output.
+
+    When `collapse_passed` is set, lines reporting a passing test are only
+    counted. All output is also written to `log_file` (if given).
+    """
+
+    def __init__(self, max_lines=1000, collapse_passed=True, log_file=None):
+        self.lines = collections.deque(maxlen=max_lines)
+        self.collapse_passed = collapse_passed
+        self.log_file = log_file
+        self.passed = 0
+        self.total_lines = 0
+        self.dirty = False
+        self._partial = ''
+        self._lock = threading.Lock()
+
+    def write(self, text):
+        text = ANSI_ESCAPE.sub('', text).replace('\r\n', '\n')
+        with self._lock:
+            if self.log_file:
+                self.log_file.write(text)
+            lines = (self._partial + text).split('\n')
+            self._partial = lines.pop()
+            for line in lines:
+                self._add_line(line)
+            self.dirty = True
+
+    def _add_line(self, line):
+        self.total_lines += 1
+        if self.collapse_passed and PASSED_LINE.search(line):
+            self.passed += 1
+            return
+        self.lines.append(line)
+
+    def detach(self):
+        """ Stop writing to the log file """
+        with self._lock:
+            if self.log_file:
+                self.log_file.close()
+                self.log_file = None
+
+    def close(self):
+        with self._lock:
+            if self._partial:
+                self._add_line(self._partial)
+                self._partial = ''
+                self.dirty = True
+            if self.log_file:
+                self.log_file.close()
+
+    @property
+    def hidden(self):
+        return self.total_lines - self.passed - len(self.lines)
+
+    def render(self):
+        """ Return the visible text, and mark the buffer as clean """
+        with self._lock:
+            self.dirty = False
+            header = []
+            if self.passed:
+                header.append('[%s passed tests collapsed]' % self.passed)
+            if self.hidden:
+                header.append('[%s earlier lines hidden, see full log: %s]' % (
+                    self.hidden, getattr(self.log_file, 'name', 'N/A')))
+            return '\n'.join(header + list(self.lines) + [self._partial])
+
+
+class ThrottledRun(object):
+    """
+    Run a command, showing its output in the window's output panel, at most
+    once per `flush_interval` milliseconds. `on_finish` is called with the
+    exit code and the buffer once the process exits.
+    """
+
+    def __init__(self, window, cmd, env=None, working_dir='', syntax=None,
+                 flush_interval=200, max_lines=1000, collapse_passed=True,
+                 on_finish=None):
+        # type: (sublime.Window, list, Optional[dict], str, Optional[str], int, int, bool, Optional[Callable]) -> None  # noqa
+        self.window = window
+        self.cmd = cmd
+        self.env = env or {}
+        self.working_dir = working_dir
+        self.syntax = syntax
+        self.flush_interval = flush_interval
+        self.on_finish = on_finish
+        self.log_path = os.path.join(get_cache_dir('logs'), 'window-%s.log' % window.id())
+        self.buffer = OutputBuffer(max_lines=max_lines, collapse_passed=collapse_passed)
+        self.proc = None
+        self.returncode = None
+        self.killed = False
+        self.detached = False
+
+    def start(self):
+        previous = _runs.get(self.window.id())
+        if previous:
+            # the previous run stops writing to the panel and log before they're reused
+            previous.kill(detach=True)
+        _runs[self.window.id()] = self
+        _logs[self.window.id()] = self.log_path
+        self.buffer.log_file = codecs.open(self.log_path, 'w', encoding='utf8')
+
+        self.panel = create_panel(self.window, syntax=self.syntax)
+
+        env = os.environ.copy()
+        env.update(dict(
+            (name, os.path.expandvars(value)) for name, value in self.env.items()))
+        _log('Running throttled command: ', self.cmd)
+        self.start_time = time.time()
+        try:
+            self.proc = subprocess.Popen(
+                self.cmd, env=env, cwd=self.working_dir or None,
+                stdin=subprocess.DEVNULL, stdout=subprocess.PIPE, stderr=subprocess.STDOUT)
+        except OSError as e:
+            self.buffer.write('[Failed to run %s: %s]\n' % (' '.join(self.cmd), e))
+            self.returncode = -1
+            self.buffer.close()
+        else:
+            threading.Thread(target=self._read).start()
+        self._tick()
+
+    def kill(self, detach=False):
+        """
+        Terminate the process. A detached run no longer writes to its log or
+        updates the panel (e.g when replaced by a new run in the window).
+        """
+        if detach:
+            self.detached = True
+            self.buffer.detach()
+        if self.proc and self.returncode is None:
+            self.killed = True
+            self.proc.terminate()
+
+    def _read(self):
+        decoder = codecs.getincrementaldecoder('utf8')('replace')
+        stream = self.proc.stdout.fileno()
+        while True:
+            data = os.read(stream, 2 ** 16)
+            if not data:
+                break
+            self.buffer.write(decoder.decode(data))
+        self.buffer.write(decoder.decode(b'', final=True))
+        self.proc.stdout.close()
+        self.buffer.close()
+        self.returncode = self.proc.wait()
+
+    def _redraw(self, footer=''):
+        text = self.buffer.render() + footer
+        self.panel.run_command('test_plier_replace_panel', {'text': text})
+
+    def _tick(self):
+        if self.detached:
+            return
+        if self.returncode is None:
+            if self.buffer.dirty:
+                self._redraw()
+            sublime.set_timeout(self._tick, self.flush_interval)
+            return
+
+        elapsed = time.time() - self.start_time
+        if self.killed:
+            status = '[Cancelled]'
+        elif self.returncode:
+            status = '[Finished in %.1fs with exit code %s]' % (elapsed, self.returncode)
+        else:
+            status = '[Finished in %.1fs]' % elapsed
+        self._redraw(footer='\n' + status)
+        sublime.status_message(status)
+        if _runs.get(self.window.id()) is self:
+            del _runs[self.window.id()]
+        if self.on_finish and not self.killed:
+            # cancelled runs (terminated) didn't finish, so their result is unknown
+            self.on_finish(self.returncode, self.buffer)
+
+
+class TestPlierExecCommand(sublime_plugin.WindowCommand):
+    """ Run a command like `exec`, with a throttled and bounded output panel """
+
+    def run(self, cmd=None, env=None, working_dir='', syntax=None, kill=False,
+            flush_interval=200, max_lines=1000, collapse_passed=True, **kwargs):
+        if kill:
+            run = _runs.get(self.window.id())
+            if run:
+                run.kill()
+            return
+        if kwargs:
+            _log('Ignoring unsupported arguments: ', kwargs)
+        ThrottledRun(
+            self.window, cmd, env=env, working_dir=working_dir, syntax=syntax,
+            flush_interval=flush_interval, max_lines=max_lines,
+            collapse_passed=collapse_passed,
+        ).start()
+
+
+class TestPlierReplacePanelCommand(sublime_plugin.TextCommand):
+    """ Replace the whole content of a (read-only) output panel """
+
+    def run(self, edit, text=''):
+        self.view.set_read_only(False)
+        self.view.replace(edit, sublime.Region(0, self.view.size()), text)
+        self.view.set_read_only(True)
+        self.view.show(self.view.size())
+
+
+class TestPlierOpenLogCommand(sublime_plugin.WindowCommand):
+    """ Open the full output log of the last throttled run in this window """
+
+    def is_enabled(self):
+        return os.path.exists(_logs.get(self.window.id(), ''))
+
+    def run(self):
+        self.window.open_file(_logs[self.window.id()])
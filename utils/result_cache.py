@@ -0,0 +1,234 @@
+"""
+Cache of passing test results, so re-running a test whose inputs haven't
+changed can show the previous result instantly.
+
+Results are keyed on the test command (the "node id"), the content of the
+test module, its conftest.py files and all the project modules they import
+(transitively), the python interpreter and the environment. Only passing
+results are stored; a node id that both passed and failed with the same
+inputs is marked as flaky and never served from the cache again.
+"""
+import ast
+import hashlib
+import json
+import os
+import shutil
+import threading
+import time
+
+from . import _log, get_cache_dir
+
+MYPY = False
+if MYPY:
+    from typing import Dict, List, Optional, Set, Tuple
+
+MAX_ENTRIES = 500
+CACHE_FILENAME = 'results.json'
+
+# (mtime, size) -> (sha1, imported module names), by file path
+_file_info = {}  # type: Dict[str, Tuple[Tuple[float, int], Tuple[str, List[str]]]]
+
+
+def _package_dir(filename, level):
+    # type: (str, int) -> str
+    """ Return the directory a relative import of `level` dots refers to """
+    dirname = os.path.dirname(filename)
+    for _ in range(level - 1):
+        dirname = os.path.dirname(dirname)
+    return dirname
+
+
+def parse_imports(filename, source):
+    # type: (str, bytes) -> List[str]
+    """
+    Return the modules imported by given source; names of relative imports
+    are returned as paths (without extension) relative to `filename`.
+    """
+    try:
+        tree = ast.parse(source)
+    except (SyntaxError, ValueError):
+        return []
+    imports = []
+    for node in ast.walk(tree):
+        if isinstance(node, ast.Import):
+            imports.extend(alias.name for alias in node.names)
+        elif isinstance(node, ast.ImportFrom):
+            if node.level:
+                base = _package_dir(filename, node.level)
+                if node.module:
+                    base = os.path.join(base, *node.module.split('.'))
+                imports.append(base)
+                imports.extend(os.path.join(base, alias.name) for alias in node.names)
+            elif node.module:
+                imports.append(node.module)
+                imports.extend('%s.%s' % (node.module, alias.name) for alias in node.names)
+    return imports
+
+
+def file_info(filename):
+    # type: (str) -> Tuple[str, List[str]]
+    """ Return the (memoized) content hash and imports of a source file """
+    stat = os.stat(filename)
+    signature = (stat.st_mtime, stat.st_size)
+    cached = _file_info.get(filename)
+    if cached and cached[0] == signature:
+        return cached[1]
+    with open(filename, 'rb') as source_file:
+        source = source_file.read()
+    info = (hashlib.sha1(source).hexdigest(), parse_imports(filename, source))
+    _file_info[filename] = (signature, info)
+    return info
+
+
+def _module_files(name, roots):
+    # type: (str, List[str]) -> List[str]
+    """ Find the project files of an imported module (and its packages) """
+    if os.path.isabs(name):
+        paths = [name]
+    else:
+        parts = name.split('.')
+        paths = [os.path.join(root, *parts[:i]) for root in roots for i in range(1, len(parts) + 1)]
+    files = []
+    for path in paths:
+        for candidate in (path + '.py', os.path.join(path, '__init__.py')):
+            if os.path.isfile(candidate):
+                files.append(candidate)
+    return files
+
+
+def _conftest_files(filename, roots):
+    # type: (str, List[str]) -> List[str]
+    files = []
+    dirname = os.path.dirname(filename)
+    while any(dirname.startswith(root) for root in roots):
+        conftest = os.path.join(dirname, 'conftest.py')
+        if os.path.isfile(conftest):
+            files.append(conftest)
+        parent = os.path.dirname(dirname)
+        if parent == dirname:
+            break
+        dirname = parent
+    return files
+
+
+def source_hashes(filename, roots):
+    # type: (str, List[str]) -> Dict[str, str]
+    """
+    Return content hashes of the test module, its conftest.py files and all
+    project modules (found under `roots`) imported by them, transitively.
+    """
+    roots = [os.path.abspath(root) for root in roots if root]
+    hashes = {}
+    pending = [os.path.abspath(filename)] + _conftest_files(os.path.abspath(filename), roots)
+    while pending:
+        path = pending.pop()
+        if path in hashes:
+            continue
+        digest, imports = file_info(path)
+        hashes[path] = digest
+        for name in imports:
+            pending.extend(_module_files(name, roots))
+    return hashes
+
+
+def interpreter_signature(env):
+    # type: (Dict[str, str]) -> str
+    """ Identify the python executable found on the environment PATH """
+    python = shutil.which('python', path=env.get('PATH') or None)
+    if not python:
+        return ''
+    python = os.path.realpath(python)
+    return '%s@%s' % (python, os.path.getmtime(python))
+
+
+class ResultCache(object):
+    """ A JSON file backed store of passing results, keyed by input hashes """
+
+    def __init__(self, path):
+        self.path = path
+        self.lock = threading.Lock()
+        try:
+            with open(path) as cache_file:
+                data = json.load(cache_file)
+        except (IOError, ValueError):
+            data = {}
+        self.results = data.get('results', {})  # type: Dict[str, dict]
+        self.failed = data.get('failed', {})  # type: Dict[str, float]
+        self.flaky = set(data.get('flaky', []))  # type: Set[str]
+
+    def key(self, node_id, filename, roots, env, working_dir=''):
+        # type: (str, str, List[str], Dict[str, str], str) -> str
+        key_data = {
+            'node_id': node_id,
+            'working_dir': working_dir,
+            'sources': source_hashes(filename, roots) if filename else {},
+            'python': interpreter_signature(env),
+            'env': env,
+        }
+        return hashlib.sha1(json.dumps(key_data, sort_keys=True).encode('utf8')).hexdigest()
+
+    def get(self, node_id, key):
+        # type: (str, str) -> Optional[dict]
+        with self.lock:
+            if node_id in self.flaky:
+                _log('Not using cached result of flaky test: ', node_id)
+                return None
+            return self.results.get(key)
+
+    def record(self, node_id, key, returncode, output):
+        # type: (str, str, int, str) -> None
+        with self.lock:
+            if returncode:
+                if key in self.results:
+                    _log('Test passed and failed with the same inputs (flaky): ', node_id)
+                    self.flaky.add(node_id)
+                    del self.results[key]
+                self.failed[key] = time.time()
+            elif key in self.failed:
+                _log('Test failed and passed with the same inputs (flaky): ', node_id)
+                self.flaky.add(node_id)
+            elif node_id not in self.flaky:
+                self.results[key] = {'node_id': node_id, 'time': time.time(), 'output': output}
+            self._trim()
+            self.save()
+
+    def clear_flaky(self):
+        # type: () -> int
+        """
+        Forget the flaky tests (e.g once fixed) and recorded failures, so
+        flakiness is detected anew; return how many flaky tests there were.
+        """
+        with self.lock:
+            count = len(self.flaky)
+            self.flaky.clear()
+            self.failed.clear()
+            self.save()
+        return count
+
+    def _trim(self):
+        while len(self.results) > MAX_ENTRIES:
+            del self.results[min(self.results, key=lambda k: self.results[k]['time'])]
+        while len(self.failed) > MAX_ENTRIES:
+            del self.failed[min(self.failed, key=self.failed.get)]
+
+    def save(self):
+        data = {
+            'results': self.results,
+            'failed': self.failed,
+            'flaky': sorted(self.flaky),
+        }
+        tmp_path = self.path + '.tmp'
+        with open(tmp_path, 'w') as cache_file:
+            json.dump(data, cache_file)
+        os.replace(tmp_path, self.path)
+
+
+_result_cache = None  # type: Optional[ResultCache]
+
+
+def get_result_cache():
+    # type: () -> ResultCache
+    global _result_cache
+    if _result_cache is None:
+        _result_cache = ResultCache(os.path.join(get_cache_dir(), CACHE_FILENAME))
+    return _result_cache
@@ -0,0 +1,455 @@
+"""
+Build test runs as immutable `RunRequest` objects.
+
+Everything a run depends on is read from the editor up front, into
+`ViewState` and `WindowState` snapshots and a copy of the settings. These
+are turned into a `RunRequest` by `build_run_request()`, which doesn't touch
+the editor, so requests can be built on worker threads (e.g concurrently for
+several windows), cached per view state and settings revision, and handed to
+the launcher.
+
+Building a request isn't free of side effects though: it reads the disk (to
+find the virtualenv, import root and fixtures of the file), memoizes import
+roots (see `modules.clear_import_roots()`), and may walk the project to
+update the fixture index, rewriting its cache file. These are safe to share
+between threads: the memo only ever gains the same value for a directory,
+and the fixture indexes are updated under a lock and swapped in whole.
+"""
+import collections
+from copy import deepcopy
+import json
+import os
+import re
+import shlex
+import threading
+
+from . import _log, get_first_selection, get_selection_content, get_test, timed
+from .modules import find_import_root, get_module
+
+MYPY = False
+if MYPY:
+    import sublime
+    from typing import Dict, List, Optional
+
+ANSI_SYNTAX = "Packages/ANSIescape/ANSI.tmLanguage"
+# placeholders which are repeated for each target, when running many tests
+TARGET_PLACEHOLDERS = ('filename', 'module', 'test_class', 'test_func')
+# settings (and their defaults) a run request may depend on
+SETTINGS_DEFAULTS = {
+    'default_cmd': [],
+    'default_external': None,
+    'python_executable': None,
+    'throttled_output': False,
+    'output_flush_interval': 200,
+    'output_max_lines': 1000,
+    'output_collapse_passed': True,
+    'result_cache': False,
+    'fixture_targeting': True,
+    'collection_cache': False,
+    'tmux_session': '',
+    'tmux_clear': False,
+    'tmux_if_busy': 'abort',
+}
+MAX_CACHED_REQUESTS = 64
+
+ViewState = collections.namedtuple('ViewState', [
+    'filename', 'test_class', 'test_func', 'selection',
+])
+WindowState = collections.namedtuple('WindowState', [
+    'project_path', 'project_base_name', 'folders', 'packages',
+])
+
+
+class NothingToRun(Exception):
+    """ Raised when a request has no tests to run """
+
+
+def _freeze(value):
+    if isinstance(value, dict):
+        return tuple(sorted((key, _freeze(item)) for key, item in value.items()))
+    if isinstance(value, list):
+        return tuple(_freeze(item) for item in value)
+    return value
+
+
+def _thaw(value):
+    if isinstance(value, tuple):
+        return [_thaw(item) for item in value]
+    return value
+
+
+class RunRequest(collections.namedtuple('RunRequest', [
+        'cmd', 'env', 'working_dir', 'exec_args', 'external', 'syntax', 'ansi',
+        'filename', 'module', 'test_class', 'test_func', 'project_path', 'project_name',
+        'throttled_output', 'result_cache', 'collection_cache', 'stress', 'shell_env'])):
+    """
+    A fully resolved test run. `cmd`, `env` and `exec_args` (arguments passed
+    through to the build command) are stored as tuples; `stress` holds the
+    `StressOptions` of a stress run (or None). `shell_env` is the configured
+    environment, whose PATH (if any) only holds the directories to prepend.
+    """
+    __slots__ = ()
+
+    def env_dict(self):
+        # type: () -> Dict[str, str]
+        return dict(self.env)
+
+    def exec_kwargs(self):
+        # type: () -> dict
+        """ Arguments for the `exec` (like) build commands """
+        kwargs = dict((name, _thaw(value)) for name, value in self.exec_args)
+        kwargs.update(cmd=list(self.cmd), env=self.env_dict(), working_dir=self.working_dir)
+        if self.syntax:
+            kwargs['syntax'] = self.syntax
+        return kwargs
+
+    @property
+    def run_dir(self):
+        # type: () -> str
+        if self.working_dir:
+            return self.working_dir
+        elif self.filename:
+            # for running individual arbitrary test modules
+            return os.path.dirname(self.filename)
+        return ''
+
+    def shell_command(self, inherit_path=False):
+        # type: (bool) -> str
+        """
+        Build a (quoted) shell command line. With `inherit_path` only the
+        configured environment is set, and the shell's own PATH is extended
+        rather than replaced by Sublime's (e.g to keep a virtualenv activated
+        in a tmux pane).
+        """
+        if inherit_path:
+            _env = ' '.join(
+                '%s=%s:"$PATH"' % (ename, shlex.quote(evalue)) if ename == 'PATH'
+                else '%s=%s' % (ename, shlex.quote(evalue))
+                for ename, evalue in self.shell_env)
+        else:
+            _env = ' '.join('%s=%s' % (ename, shlex.quote(evalue)) for ename, evalue in self.env)
+        change_dir_cmd = ''
+        if self.run_dir:
+            change_dir_cmd = 'cd {path} && '.format(path=shlex.quote(self.run_dir))
+
+        return '{cwd}{env_setup}{cmd}'.format(
+            cwd=change_dir_cmd,
+            cmd=' '.join(shlex.quote(part) for part in self.cmd),
+            env_setup=_env + ' ' if _env else '',
+        )
+
+
+def snapshot_settings(settings):
+    # type: (sublime.Settings) -> Dict
+    return dict(
+        (name, deepcopy(settings.get(name, default)))
+        for name, default in SETTINGS_DEFAULTS.items())
+
+
+def snapshot_window(window, packages):
+    # type: (sublime.Window, set) -> WindowState
+    variables = window.extract_variables()
+    return WindowState(
+        project_path=variables.get('project_path', ''),
+        project_base_name=variables.get('project_base_name', ''),
+        folders=tuple(window.folders()),
+        packages=frozenset(packages),
+    )
+
+
+def snapshot_view(view, python_executable=None):
+    # type: (sublime.View, Optional[str]) -> ViewState
+    """ Read the file, test (under the cursor) and selection of a view """
+    _log("View: ", view)
+    pattern = view and get_test(view, use_python=python_executable)
+    _log('Test pattern: ', pattern)
+    test_class, test_func = pattern or (None, None)
+    return ViewState(
+        filename=view and view.file_name(),
+        test_class=test_class,
+        test_func=test_func,
+        selection=view and get_selection_content(view),
+    )
+
+
+def find_venv_root(filename):
+    # type: (str) -> Optional[str]
+    dirname = os.path.dirname(os.path.abspath(filename))
+    while dirname != '/':
+        if '.venv' in os.listdir(dirname):
+            venv_file = os.path.join(dirname, '.venv')
+            with open(venv_file) as f:
+                venv = f.read().strip()
+            _log("Venv found '%s' checking path" % venv)
+            venv_path = os.path.expanduser('~/.virtualenvs/%s' % venv)
+            if os.path.exists(venv_path):
+                _log("Venv path exists at '%s'" % venv_path)
+                return venv_path
+            _log("Venv path does not exist at '%s'" % venv_path)
+        dirname = os.path.dirname(dirname)
+    return None
+
+
+def format_placeholders(cmd, sep, targets=None, **kwargs):
+    # type: (List[str], str, Optional[List[dict]], **str) -> List[str]
+    """
+    Format placeholders of each part of the command. When a list of
+    `targets` (filename/module/test_class/test_func kwargs) is given, parts
+    with target placeholders are repeated for each target.
+    """
+    result = []
+    for part in cmd:
+        part_kwargs = [kwargs]
+        if targets is not None and any(
+                '{%s}' % name in part for name in TARGET_PLACEHOLDERS):
+            part_kwargs = [dict(kwargs, **target) for target in targets]
+        for fmt_kwargs in part_kwargs:
+            try:
+                formatted = part.format(**fmt_kwargs).strip(sep).strip('.')
+                cleaned_part = re.sub('%s+' % sep, sep, formatted).strip(sep)
+                if cleaned_part:
+                    result.append(cleaned_part)
+            except KeyError:
+                # ignore commands with unparsed parts
+                continue
+    return result
+
+
+def get_project_root(filename, folders):
+    # type: (str, List[str]) -> str
+    """ The project folder containing given file (or its import root) """
+    for folder in folders:
+        if filename.startswith(os.path.join(folder, '')):
+            return folder
+    dirname = os.path.dirname(os.path.abspath(filename))
+    return find_import_root(dirname) or dirname
+
+
+def get_fixture_targets(view_state, window_state, module_base, working_dir=''):
+    # type: (ViewState, WindowState, str, str) -> Optional[List[dict]]
+    """
+    Return the targets of all tests using the fixture under the cursor
+    (directly or transitively), or None if it isn't in a fixture.
+    """
+    from .fixtures import get_fixture_index, is_fixture
+
+    filename, class_name, func_name = view_state[:3]
+    if not (filename and func_name and is_fixture(filename, class_name, func_name)):
+        return None
+    with timed('Updating the fixture index'):
+        index = get_fixture_index(get_project_root(filename, window_state.folders))
+    fixture_id = index.find_fixture(os.path.abspath(filename), class_name, func_name)
+    if fixture_id is None:
+        return None
+    tests = index.tests_using(fixture_id)
+    _log('Tests using fixture %s: %s' % (fixture_id, tests))
+    return [
+        dict(filename=path, module=get_module(path, base=module_base, working_dir=working_dir),
+             test_class=test_class or '', test_func=test_func)
+        for path, test_class, test_func in tests
+    ]
+
+
+def get_selection_targets(view_state, window_state, cmd, module_base, working_dir=''):
+    # type: (ViewState, WindowState, List[str], str, str) -> Optional[List[dict]]
+    """
+    Return the targets of the (collected) tests of the current module matching
+    the selection, or None if it cannot be resolved (e.g not collected yet).
+    """
+    from .collection import get_collection, pytest_command
+
+    filename = view_state.filename
+    if not (filename and pytest_command(cmd) and any('{selection}' in part for part in cmd)):
+        return None
+    filename = os.path.abspath(filename)
+    collection = get_collection(get_project_root(filename, window_state.folders))
+    node_ids = collection.resolve(
+        filename, view_state.selection, view_state.test_class, view_state.test_func)
+    _log('Tests matching selection %r: %s' % (view_state.selection, node_ids))
+    if not node_ids:
+        return None
+    module = get_module(filename, base=module_base, working_dir=working_dir)
+    return [
+        dict(filename=filename, module=module, test_class='', test_func=node_id)
+        for node_id in node_ids
+    ]
+
+
+def refresh_collection(request, window_state):
+    # type: (RunRequest, WindowState) -> None
+    """ Collect the tests of the request's project in the background """
+    from .collection import pytest_command, refresh_async
+
+    pytest_cmd = pytest_command(list(request.cmd))
+    if not (pytest_cmd and request.filename):
+        return
+    env = dict(os.environ, **request.env_dict())
+    refresh_async(
+        get_project_root(request.filename, window_state.folders), pytest_cmd, env,
+        on_change=bump_revision)
+
+
+def build_run_request(view_state, window_state, settings, command_kwargs, external_runner=None):
+    # type: (ViewState, WindowState, Dict, Dict, Optional[object]) -> RunRequest
+    """
+    Resolve a test run from the state of the editor and command kwargs.
+    Safe to call from any thread, but reads the disk and may update the
+    import root memo and fixture index (see the module docstring).
+    """
+    kwargs = {
+        'cmd': settings['default_cmd'],
+        # trim the following string in-between interpolated parts
+        'sep_cleanup': '::',
+    }
+    ansi = 'sublimeansi' in window_state.packages or 'ansiescape' in window_state.packages
+    _log('SublimeANSI installed: %s' % ansi)
+    if ansi:
+        kwargs['syntax'] = ANSI_SYNTAX
+    kwargs = deepcopy(kwargs)
+    kwargs.update(deepcopy(command_kwargs))
+    kwargs['cmd'].extend(kwargs.pop('extra_cmd_args', []))
+    filename = view_state.filename
+
+    # get the command environment
+    # TODO: infer from settings.python_interpreter and settings.src_root settings
+    #       as used in https://github.com/JulianEberius/SublimePythonIDE
+    env = kwargs.pop('env', None) or {}
+    if 'PATH' not in env:
+        # add .venv path if it exists
+        venv_path = filename and find_venv_root(filename)
+        if venv_path:
+            env['PATH'] = '%s/bin' % venv_path
+    shell_env = _freeze(env)
+    # merge path with Sublime's env PATH
+    env['PATH'] = '%s:%s' % (env.get('PATH', ''), os.environ["PATH"])
+    _log("Current PATH is %s" % os.getenv("PATH"))
+
+    working_dir = kwargs.pop('working_dir', '')
+    module_base = working_dir or os.path.join(
+        window_state.project_path, window_state.project_base_name)
+    module = get_module(filename, base=module_base, working_dir=working_dir)
+    _log("Module: ", module)
+
+    fmt_args = dict(
+        module=module or '',
+        filename=filename or '',
+        test_class=view_state.test_class or '',
+        test_func=view_state.test_func or '',
+    )
+    if view_state.selection:
+        fmt_args['selection'] = view_state.selection
+
+    targets = None
+    if settings['fixture_targeting']:
+        targets = get_fixture_targets(view_state, window_state, module_base, working_dir)
+        if targets == []:
+            raise NothingToRun('no tests use the fixture %s' % view_state.test_func)
+
+    collection_cache = bool(kwargs.pop('collection_cache', settings['collection_cache']))
+    if targets is None and collection_cache and view_state.selection:
+        # run the matching node ids, rather than filtering the module with -k
+        targets = get_selection_targets(
+            view_state, window_state, kwargs['cmd'], module_base, working_dir)
+        if targets:
+            del fmt_args['selection']
+
+    cmd = format_placeholders(kwargs.pop('cmd'), kwargs.pop('sep_cleanup'), targets=targets, **fmt_args)
+
+    # default external command can be used if not given
+    external = kwargs.pop('external', external_runner)
+    if external is True:
+        external = settings['default_external'] or True
+    kwargs.pop('python_executable', None)
+
+    stress = None
+    stress_runs = int(kwargs.pop('stress', 0) or 0)
+    stress_fail_fast = bool(kwargs.pop('stress_fail_fast', False))
+    stress_seed = kwargs.pop('stress_seed', None)
+    if stress_runs:
+        from .stress import StressOptions
+        stress = StressOptions(runs=stress_runs, fail_fast=stress_fail_fast, seed=stress_seed)
+
+    request = RunRequest(
+        cmd=tuple(cmd),
+        env=_freeze(env),
+        working_dir=working_dir,
+        syntax=kwargs.pop('syntax', None),
+        ansi=ansi,
+        external=_freeze(external) if external else None,
+        filename=filename,
+        module=module,
+        test_class=view_state.test_class,
+        test_func=view_state.test_func,
+        project_path=window_state.project_path,
+        project_name=window_state.project_base_name,
+        throttled_output=bool(kwargs.pop('throttled_output', settings['throttled_output'])),
+        result_cache=bool(kwargs.pop('result_cache', settings['result_cache'])),
+        collection_cache=collection_cache,
+        stress=stress,
+        shell_env=shell_env,
+        exec_args=_freeze(kwargs),
+    )
+    _log("Built request: ", request)
+    return request
+
+
+class RequestCache(object):
+    """
+    A bounded, thread-safe cache of run requests; keyed by the view, its
+    change count and selection, the settings revision and command kwargs.
+    """
+
+    def __init__(self, max_size=MAX_CACHED_REQUESTS):
+        self.max_size = max_size
+        self.requests = collections.OrderedDict()
+        self.lock = threading.Lock()
+
+    def get(self, key):
+        with self.lock:
+            request = self.requests.get(key)
+            if request is not None:
+                self.requests.move_to_end(key)
+            return request
+
+    def put(self, key, request):
+        with self.lock:
+            self.requests[key] = request
+            while len(self.requests) > self.max_size:
+                self.requests.popitem(last=False)
+
+    def clear(self):
+        with self.lock:
+            self.requests.clear()
+
+
+requests = RequestCache()
+# bumped when the settings change, or files are saved (e.g a new test using a fixture)
+revision = [0]
+
+
+def bump_revision():
+    revision[0] += 1
+
+
+def request_key(view, window_state, command_kwargs, *extra):
+    # type: (sublime.View, WindowState, Dict, *object) -> Optional[tuple]
+    """
+    The cache key of a request, or None if it shouldn't be cached. Besides
+    the view's contents and selection, a request depends on its file name
+    (which changes without editing, e.g on Save As), the project and the
+    installed packages (e.g ANSI output).
+    """
+    if not view:
+        return None
+    region = get_first_selection(view)
+    if region is None:
+        return None
+    try:
+        kwargs = json.dumps(command_kwargs, sort_keys=True)
+    except (TypeError, ValueError):
+        return None
+    project = (
+        window_state.project_path, window_state.project_base_name, window_state.folders,
+        window_state.packages)
+    return (view.id(), view.file_name(), view.change_count(), region.a, region.b,
+            project, revision[0], kwargs) + extra
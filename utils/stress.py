@@ -0,0 +1,174 @@
+"""
+Stress (flakiness) runs: run a test command many times in parallel, and
+report how many runs passed or failed, their durations and the output of the
+first failure.
+
+Each run is a separate process (at most one per CPU at a time) with its own
+temporary directory (`TMPDIR`, `TEMP` and `TMP`), and optionally a seed of
+its own, passed as `PYTHONHASHSEED` and `TEST_PLIER_SEED`.
+"""
+import collections
+from concurrent.futures import ThreadPoolExecutor
+import math
+import multiprocessing
+import os
+import random
+import shutil
+import subprocess
+import tempfile
+import threading
+import time
+
+import sublime
+
+from . import _log
+from .output import show_output
+
+MYPY = False
+if MYPY:
+    from typing import Dict, List, Optional
+
+MAX_SEED = 2 ** 32  # PYTHONHASHSEED must be lower than this
+PERCENTILES = (50, 90, 99)
+
+StressOptions = collections.namedtuple('StressOptions', ['runs', 'fail_fast', 'seed'])
+StressResult = collections.namedtuple('StressResult', ['index', 'returncode', 'duration', 'output', 'seed'])
+
+
+def percentile(values, percent):
+    # type: (List[float], float) -> float
+    """ The (nearest rank) percentile of given values """
+    values = sorted(values)
+    rank = int(math.ceil(percent / 100.0 * len(values))) - 1
+    return values[min(max(rank, 0), len(values) - 1)]
+
+
+def seed_for(seed, index):
+    # type: (Optional[object], int) -> Optional[int]
+    """
+    The seed of a run: random if `seed` is true, or consecutive seeds
+    starting at `seed` if it's a number (so runs can be reproduced).
+    """
+    if seed is None or seed is False:
+        return None
+    if seed is True:
+        return random.randrange(MAX_SEED)
+    return (int(seed) + index) % MAX_SEED
+
+
+def format_report(results, runs, elapsed=None, jobs=None):
+    # type: (List[StressResult], int, Optional[float], Optional[int]) -> str
+    passed = [result for result in results if not result.returncode]
+    failed = [result for result in results if result.returncode]
+    lines = ['Stress run: %s/%s runs, %s passed, %s failed' % (
+        len(results), runs, len(passed), len(failed))]
+    if len(results) < runs:
+        lines.append('Stopped after the first failure (%s runs skipped or cancelled)' % (
+            runs - len(results)))
+    if elapsed is not None:
+        lines.append('Finished in %.1fs (%s parallel runs)' % (elapsed, jobs))
+    if results:
+        durations = [result.duration for result in results]
+        lines.append('Durations: min %.2fs, %s, max %.2fs' % (
+            min(durations),
+            ', '.join('p%s %.2fs' % (percent, percentile(durations, percent)) for percent in PERCENTILES),
+            max(durations)))
+    if failed:
+        seeds = [str(result.seed) for result in failed if result.seed is not None]
+        if seeds:
+            lines.append('Seeds of failed runs: %s' % ', '.join(seeds))
+        first = failed[0]
+        lines.extend([
+            '',
+            'First failure (run %s%s, exit code %s):' % (
+                first.index + 1, '' if first.seed is None else ', seed %s' % first.seed,
+                first.returncode),
+            first.output,
+        ])
+    return '\n'.join(lines)
+
+
+class StressRun(object):
+    """
+    Run a command `options.runs` times, in up to `jobs` (the number of CPUs
+    by default) parallel processes, and show a report in the output panel.
+    """
+
+    def __init__(self, window, cmd, options, env=None, working_dir='', jobs=None, max_lines=1000):
+        # type: (sublime.Window, list, StressOptions, Optional[Dict[str, str]], str, Optional[int], int) -> None  # noqa
+        self.window = window
+        self.cmd = cmd
+        self.options = options
+        self.env = env or {}
+        self.working_dir = working_dir
+        self.jobs = max(min(jobs or multiprocessing.cpu_count(), options.runs), 1)
+        self.max_lines = max_lines
+        self.results = []  # type: List[StressResult]
+        self.lock = threading.Lock()
+        self.stopped = threading.Event()
+        self.procs = set()  # type: set
+
+    def start(self):
+        sublime.status_message('Test Plier: starting %s runs' % self.options.runs)
+        threading.Thread(target=self.run).start()
+
+    def run(self):
+        # type: () -> str
+        _log('Stress running %s times (%s parallel): %s' % (self.options.runs, self.jobs, self.cmd))
+        start_time = time.time()
+        with ThreadPoolExecutor(max_workers=self.jobs) as executor:
+            for index in range(self.options.runs):
+                executor.submit(self.run_once, index)
+        # results are in the order runs finished, so the first failure is shown
+        report = format_report(self.results, self.options.runs, time.time() - start_time, self.jobs)
+        sublime.set_timeout(lambda: show_output(self.window, report), 0)
+        return report
+
+    def run_once(self, index):
+        # type: (int) -> Optional[StressResult]
+        if self.stopped.is_set():
+            return None
+        seed = seed_for(self.options.seed, index)
+        tmp_dir = tempfile.mkdtemp(prefix='test-plier-')
+        env = os.environ.copy()
+        env.update(dict((name, os.path.expandvars(value)) for name, value in self.env.items()))
+        env.update(TMPDIR=tmp_dir, TEMP=tmp_dir, TMP=tmp_dir)
+        if seed is not None:
+            env.update(PYTHONHASHSEED=str(seed), TEST_PLIER_SEED=str(seed))
+
+        start_time = time.time()
+        proc = None
+        try:
+            proc = subprocess.Popen(
+                self.cmd, env=env, cwd=self.working_dir or None,
+                stdin=subprocess.DEVNULL, stdout=subprocess.PIPE, stderr=subprocess.STDOUT)
+            with self.lock:
+                self.procs.add(proc)
+            output, _ = proc.communicate()
+            output = output.decode('utf8', 'replace')
+            returncode = proc.returncode
+        except OSError as e:
+            output, returncode = 'Failed to run %s: %s' % (' '.join(self.cmd), e), -1
+        finally:
+            shutil.rmtree(tmp_dir, ignore_errors=True)
+        result = StressResult(
+            index, returncode, time.time() - start_time,
+            '\n'.join(collections.deque(output.splitlines(), maxlen=self.max_lines)), seed)
+
+        with self.lock:
+            self.procs.discard(proc)
+            if self.stopped.is_set():
+                return None  # cancelled after another run failed
+            self.results.append(result)
+            if returncode and self.options.fail_fast:
+                self.stop()
+            done, failed = len(self.results), sum(1 for r in self.results if r.returncode)
+        sublime.set_timeout(lambda: sublime.status_message(
+            'Test Plier: %s/%s runs done, %s failed' % (done, self.options.runs, failed)), 0)
+        return result
+
+    def stop(self):
+        """ Skip the remaining runs and terminate the running ones """
+        self.stopped.set()
+        for proc in self.procs:
+            proc.terminate()
@@ -0,0 +1,123 @@
+"""
+Find the test class/method containing a line using the editor's own symbol
+data (from the syntax definition), without copying the whole buffer.
+
+This follows the rules of `test_parser.TestParser`, reading only the lines
+defining each class/function. When symbols aren't available, or a definition
+can't be read from its line alone (e.g bases or arguments continue on the
+next line), None is returned so the caller can fall back to `TestParser`.
+"""
+import re
+
+from . import _log
+
+MYPY = False
+if MYPY:
+    import sublime
+    from typing import List, Optional, Tuple
+
+CLASS_SELECTOR = 'entity.name.class'
+FUNCTION_SELECTOR = 'entity.name.function'
+CLASS_LINE = re.compile(r'^(\s*)class\s+(\w+)\s*(?:\(([^()]*)\))?\s*:')
+DEF_LINE = re.compile(r'^(\s*)(?:async\s+)?def\s+(\w+)\s*\((.*)$')
+FIRST_ARG = re.compile(r'\s*(\*{0,2}\w+|\))')
+
+
+class Ambiguous(Exception):
+    pass
+
+
+def symbol_regions(view):
+    # type: (sublime.View) -> List[sublime.Region]
+    """ Regions of the class/function names defined in the view, in order """
+    if hasattr(view, 'indexed_symbol_regions'):
+        # Sublime Text 4
+        symbols = view.indexed_symbol_regions() or view.symbol_regions()
+        regions = [symbol.region for symbol in symbols]
+    else:
+        regions = [region for region, name in view.symbols()]
+    if not regions:
+        regions = view.find_by_selector('%s, %s' % (CLASS_SELECTOR, FUNCTION_SELECTOR))
+    return sorted(regions, key=lambda region: region.begin())
+
+
+def _base_names(bases):
+    # type: (Optional[str]) -> List[str]
+    names = []
+    for base in (bases or '').split(','):
+        base = base.strip()
+        if not base or '=' in base:
+            continue  # e.g metaclass keyword
+        if not re.match(r'^[\w.]+$', base):
+            raise Ambiguous('Unknown base %s' % base)
+        names.append(base.split('.')[-1])
+    return names
+
+
+def _first_arg(args):
+    # type: (str) -> Optional[str]
+    match = FIRST_ARG.match(args)
+    if not match:
+        raise Ambiguous('Arguments continue on the next line')
+    return None if match.group(1) == ')' else match.group(1)
+
+
+def _definitions(view, line):
+    # type: (sublime.View, int) -> List[Tuple[str, int, str, object]]
+    """ (kind, indent, name, extra) of the definitions up to given line """
+    definitions = []
+    for region in symbol_regions(view):
+        if view.rowcol(region.begin())[0] + 1 > line:
+            break
+        if view.match_selector(region.begin(), CLASS_SELECTOR):
+            match = CLASS_LINE.match(view.substr(view.line(region)))
+            if not match:
+                raise Ambiguous('Cannot read class definition')
+            indent, name, bases = match.groups()
+            definitions.append(('class', len(indent), name, _base_names(bases)))
+        elif view.match_selector(region.begin(), FUNCTION_SELECTOR):
+            match = DEF_LINE.match(view.substr(view.line(region)))
+            if not match:
+                raise Ambiguous('Cannot read function definition')
+            indent, name, args = match.groups()
+            definitions.append(('function', len(indent), name, _first_arg(args)))
+    return definitions
+
+
+def get_test_from_symbols(view, line, ignore_bases=None):
+    # type: (sublime.View, int, Optional[List[str]]) -> Optional[Tuple[Optional[str], Optional[str]]]
+    """
+    Return the (class, method/function) names containing given line, or None
+    if they cannot be determined from the symbols.
+    """
+    ignore_bases = ignore_bases or []
+    try:
+        if not symbol_regions(view):
+            return None
+        definitions = _definitions(view, line)
+    except Ambiguous as e:
+        _log('Cannot use symbols to find the test: ', e)
+        return None
+
+    nearest_class = nearest_func = nearest_ignored = nested_class = None
+    for kind, indent, name, extra in definitions:
+        ignored = kind == 'class' and any(base in ignore_bases for base in extra)
+        inside_class = (
+            not ignored and nearest_class is not None and
+            indent > nearest_class[0] and nearest_ignored is None)
+        if kind == 'class':
+            if inside_class:
+                nested_class = indent
+                continue
+            nested_class = None
+            if ignored:
+                nearest_ignored, nearest_class = indent, None
+            else:
+                nearest_class, nearest_ignored = (indent, name), None
+            nearest_func = None
+        elif inside_class:
+            if (nested_class is None or indent <= nested_class) and extra == 'self':
+                nearest_func, nearest_ignored = name, None
+        elif nearest_ignored is None:
+            nearest_class, nearest_func = None, name
+    return nearest_class and nearest_class[1], nearest_func
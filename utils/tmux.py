@@ -0,0 +1,87 @@
+"""
+Run test commands in a persistent tmux pane, rather than spawning a new
+terminal (and shell) for each run.
+
+Each project gets its own tmux session, which is created (detached) on the
+first run; attach to it with `tmux attach -t <session>`. Commands are typed
+into the session's active pane, so the already running (and activated) shell
+is reused between runs.
+"""
+import re
+import subprocess
+
+from . import _log
+
+MYPY = False
+if MYPY:
+    from typing import List, Optional
+
+# when the pane runs anything but a shell, a previous test is still running
+SHELLS = ('bash', 'zsh', 'fish', 'sh', 'dash', 'ksh', 'tcsh', 'csh')
+
+
+def session_name(project_name):
+    # type: (str) -> str
+    """
+    >>> session_name('My Project.v2')
+    'test-plier-My_Project_v2'
+    """
+    return 'test-plier-%s' % re.sub(r'[^\w-]', '_', project_name or 'default')
+
+
+class TmuxPane(object):
+    """ The active pane of a (possibly not yet existing) tmux session """
+
+    def __init__(self, session, tmux='tmux'):
+        self.session = session
+        self.target = '%s:' % session
+        self.tmux = tmux
+
+    def _run(self, *args):
+        # type: (*str) -> str
+        cmd = [self.tmux] + list(args)
+        _log('Running tmux command: ', cmd)
+        return subprocess.check_output(cmd, stderr=subprocess.STDOUT).decode('utf8')
+
+    def exists(self):
+        # type: () -> bool
+        try:
+            self._run('has-session', '-t', self.session)
+        except subprocess.CalledProcessError:
+            return False
+        return True
+
+    def ensure(self, working_dir=None):
+        # type: (Optional[str]) -> bool
+        """ Create the session if it doesn't exist, return whether it did """
+        if self.exists():
+            return False
+        args = ['new-session', '-d', '-s', self.session]
+        if working_dir:
+            args.extend(['-c', working_dir])
+        self._run(*args)
+        return True
+
+    def current_command(self):
+        # type: () -> str
+        return self._run(
+            'display-message', '-p', '-t', self.target, '#{pane_current_command}').strip()
+
+    def is_busy(self):
+        # type: () -> bool
+        command = self.current_command()
+        _log('tmux pane %s is running: %s' % (self.target, command))
+        return command not in SHELLS
+
+    def interrupt(self):
+        self._run('send-keys', '-t', self.target, 'C-c')
+
+    def clear(self):
+        self._run('send-keys', '-t', self.target, 'C-l')
+        self._run('clear-history', '-t', self.target)
+
+    def send(self, command):
+        # type: (str) -> None
+        # send the command literally (-l), so key names in it aren't expanded
+        self._run('send-keys', '-t', self.target, '-l', command)
+        self._run('send-keys', '-t', self.target, 'Enter')